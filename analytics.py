@@ -0,0 +1,541 @@
+import os
+import heapq
+import bisect
+import threading
+from itertools import chain
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytz
+
+UAE_TZ = pytz.timezone("Asia/Dubai")
+
+# ---------------------------------------------------------
+# EXCLUDED USERS
+# ---------------------------------------------------------
+EXCLUDED_USERS = ["Sebin", "Shamshad", "Jaymon", "Hisham Arackal", "Althaf", "Nidal", "Nayif Muhammed S"]
+
+# Users without an assignment are grouped under this name on the teams page
+UNASSIGNED = "Unassigned"
+
+# Users that never had a Start Date are treated as last assigned this long ago
+DEFAULT_DAYS_SINCE_LAST = int(os.getenv("DEFAULT_DAYS_SINCE_LAST", "3"))
+
+
+# ---------------------------------------------------------
+# RESULT
+# ---------------------------------------------------------
+@dataclass
+class AnalyticsResult:
+    """Every number the routes and the Excel export need, computed in one pass."""
+    overall: dict = field(default_factory=dict)
+    per_user: dict = field(default_factory=dict)
+    priorities: dict = field(default_factory=dict)
+    teams: dict = field(default_factory=dict)
+    generated_at: datetime = None
+
+
+def empty_overall():
+    return {"total_users": 0, "total_tasks": 0, "tasks_completed": 0, "tasks_pending": 0, "tasks_missed": 0, "orders_received": 0}
+
+
+def empty_teams():
+    return {"total_tasks": 0, "total_submissions": 0, "total_pending": 0, "total_missed": 0, "users": {}}
+
+
+def find_start_date_column(columns):
+    """Return the name of the Start Date column, whatever its spacing, casing or _x0020_ encoding."""
+    for col in columns:
+        if str(col).lower().replace("_x0020_", "").replace(" ", "") == "startdate":
+            return col
+    return None
+
+
+# ---------------------------------------------------------
+# ENGINE
+# ---------------------------------------------------------
+def compute_analytics(df, now=None, excluded_users=EXCLUDED_USERS):
+    """
+    Compute overall, per-user, priority and teams analytics in a single pass.
+
+    Dates are parsed once, the submitted/pending/missed masks are built once
+    for the whole frame, and all per-user numbers come from one groupby.
+    Excluded users still count towards the overall and teams totals but are
+    left out of the per-user table and the priorities, as before.
+    """
+    now = now or datetime.now(UAE_TZ)
+    result = AnalyticsResult(overall=empty_overall(), teams=empty_teams(), generated_at=now)
+    if df.empty or "AssignedTo" not in df.columns:
+        return result
+
+    now_ts = pd.Timestamp(now)
+    bcd = pd.to_datetime(df["BCD"], errors="coerce", utc=True) if "BCD" in df.columns else pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns, UTC]")
+    start_col = find_start_date_column(df.columns)
+    if start_col:
+        start = pd.to_datetime(df[start_col], errors="coerce", utc=True)
+    else:
+        start = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns, UTC]")
+
+    status = df["SubmissionStatus"] if "SubmissionStatus" in df.columns else pd.Series(None, index=df.index)
+    submitted = status.fillna("").astype(str).str.lower() == "submitted"
+    frame = pd.DataFrame({
+        "user": df["AssignedTo"],
+        "submitted": submitted,
+        "pending": ~submitted & (bcd >= now_ts),
+        "missed": ~submitted & (bcd < now_ts),
+        "received": (df["Status"] == "Received") if "Status" in df.columns else False,
+        "start": start,
+    })
+
+    # One groupby for everything; sort=False keeps first-appearance order for priority ties
+    grouped = frame.groupby("user", sort=False, dropna=False).agg(
+        total_tasks=("submitted", "size"),
+        tasks_completed=("submitted", "sum"),
+        tasks_pending=("pending", "sum"),
+        tasks_missed=("missed", "sum"),
+        orders_received=("received", "sum"),
+        last_start=("start", "max"),
+    )
+
+    totals = grouped[["total_tasks", "tasks_completed", "tasks_pending", "tasks_missed", "orders_received"]].sum()
+    result.overall = {
+        "total_users": int(grouped.index.notna().sum()),
+        "total_tasks": int(totals["total_tasks"]),
+        "tasks_completed": int(totals["tasks_completed"]),
+        "tasks_pending": int(totals["tasks_pending"]),
+        "tasks_missed": int(totals["tasks_missed"]),
+        "orders_received": int(totals["orders_received"]),
+    }
+
+    result.teams = {
+        "total_tasks": result.overall["total_tasks"],
+        "total_submissions": result.overall["tasks_completed"],
+        "total_pending": result.overall["tasks_pending"],
+        "total_missed": result.overall["tasks_missed"],
+        "users": {},
+    }
+    for user, row in grouped.iterrows():
+        name = UNASSIGNED if pd.isna(user) else user
+        counts = result.teams["users"].setdefault(name, {"tasks": 0, "submissions": 0, "pending": 0, "missed": 0})
+        counts["tasks"] += int(row["total_tasks"])
+        counts["submissions"] += int(row["tasks_completed"])
+        counts["pending"] += int(row["tasks_pending"])
+        counts["missed"] += int(row["tasks_missed"])
+
+    users = grouped[grouped.index.notna() & ~grouped.index.isin(list(excluded_users))]
+    if users.empty:
+        return result
+
+    last_local = users["last_start"].dt.tz_convert(UAE_TZ)
+    for user in sorted(users.index):
+        row = users.loc[user]
+        last = last_local.loc[user]
+        result.per_user[user] = {
+            "total_tasks": int(row["total_tasks"]),
+            "tasks_completed": int(row["tasks_completed"]),
+            "tasks_pending": int(row["tasks_pending"]),
+            "tasks_missed": int(row["tasks_missed"]),
+            "orders_received": int(row["orders_received"]),
+            "last_assigned_date": None if pd.isna(last) else last.strftime("%Y-%m-%d %H:%M"),
+        }
+
+    # Fewest active tasks first, then whoever has waited longest for a new one
+    last_start = users["last_start"].fillna(now_ts - timedelta(days=DEFAULT_DAYS_SINCE_LAST))
+    ranking = pd.DataFrame({
+        "active_tasks": users["tasks_pending"],
+        "days_since_last": (now_ts - last_start).dt.days,
+    })
+    ranking = ranking.sort_values(["active_tasks", "days_since_last"], ascending=[True, False], kind="stable")
+    result.priorities = {user: idx + 1 for idx, user in enumerate(ranking.index)}
+    return result
+
+
+# ---------------------------------------------------------
+# PER-USER ROW INDEX
+# ---------------------------------------------------------
+@dataclass
+class UserIndex:
+    """
+    Row positions per AssignedTo with deadlines and submission flags pre-parsed,
+    so one user's numbers cost O(that user's rows) instead of a full scan.
+    """
+    positions: dict = field(default_factory=dict)
+    deadlines: np.ndarray = None  # BCD as datetime64[ns] UTC, NaT when missing
+    submitted: np.ndarray = None
+
+    def rows_for(self, username):
+        return self.positions.get(username, np.empty(0, dtype=np.intp))
+
+
+def build_user_index(sp_items):
+    """Build the per-user index for a list snapshot in one pass."""
+    df = items_to_df(sp_items)
+    if df.empty or "AssignedTo" not in df.columns:
+        return UserIndex(deadlines=np.empty(0, dtype="datetime64[ns]"), submitted=np.empty(0, dtype=bool))
+
+    bcd = pd.to_datetime(df["BCD"], errors="coerce", utc=True) if "BCD" in df.columns else pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns, UTC]")
+    status = df["SubmissionStatus"] if "SubmissionStatus" in df.columns else pd.Series(None, index=df.index)
+    return UserIndex(
+        positions=df.groupby("AssignedTo", sort=False).indices,
+        deadlines=bcd.dt.tz_convert(None).to_numpy(dtype="datetime64[ns]"),
+        submitted=(status.fillna("").astype(str).str.lower() == "submitted").to_numpy(),
+    )
+
+
+def user_analytics_from_index(index, username, now=None):
+    """Tasks, submissions, pending and missed for one user, read from the index."""
+    now = now or datetime.now(UAE_TZ)
+    rows = index.rows_for(username)
+    if len(rows) == 0:
+        return {"tasks": 0, "submissions": 0, "pending": 0, "missed": 0}
+
+    submitted = index.submitted[rows]
+    deadlines = index.deadlines[rows]
+    now64 = np.datetime64(pd.Timestamp(now).tz_convert(None).to_datetime64(), "ns")
+    # Without a deadline an open task can't be missed, so it counts as pending
+    missed = ~submitted & ~np.isnat(deadlines) & (deadlines < now64)
+    submissions = int(submitted.sum())
+    missed_count = int(missed.sum())
+    return {
+        "tasks": int(len(rows)),
+        "submissions": submissions,
+        "pending": int(len(rows)) - submissions - missed_count,
+        "missed": missed_count,
+    }
+
+
+# ---------------------------------------------------------
+# INCREMENTAL AGGREGATION
+# ---------------------------------------------------------
+def _item_columns(rows):
+    """
+    Users (list), submitted and received flags (bool arrays) and deadlines and
+    start dates (datetime64[ns] arrays, NaT when missing) for rows, parsed in
+    one vectorized pass however many rows.
+    """
+    # Only the columns read below, building a frame of every column costs more than the rest
+    columns = list(dict.fromkeys(chain.from_iterable(rows)))
+    start_col = find_start_date_column(columns)
+    wanted = [col for col in ("AssignedTo", "SubmissionStatus", "Status", "BCD", start_col) if col in columns]
+    df = pd.DataFrame({col: [row.get(col) for row in rows] for col in wanted}, index=pd.RangeIndex(len(rows)))
+    none = pd.Series(None, index=df.index, dtype=object)
+    users = df["AssignedTo"].astype(object).where(df["AssignedTo"].notna(), None) if "AssignedTo" in df.columns else none
+    status = df["SubmissionStatus"] if "SubmissionStatus" in df.columns else none
+    submitted = status.fillna("").astype(str).str.lower() == "submitted"
+    received = (df["Status"] == "Received") if "Status" in df.columns else pd.Series(False, index=df.index)
+    return (
+        users.tolist(),
+        submitted.to_numpy(dtype=bool),
+        received.to_numpy(dtype=bool),
+        _utc_datetimes(df["BCD"] if "BCD" in df.columns else none),
+        _utc_datetimes(df[start_col] if start_col else none),
+    )
+
+
+def _item_records(rows):
+    """(user, submitted, received, deadline, start) for each row, with dates as UTC nanoseconds or None."""
+    if not rows:
+        return []
+    users, submitted, received, deadlines, starts = _item_columns(rows)
+    return list(zip(users, submitted.tolist(), received.tolist(), _nanos_or_none(deadlines), _nanos_or_none(starts)))
+
+
+def _utc_datetimes(values):
+    parsed = pd.to_datetime(values, errors="coerce", utc=True)
+    return parsed.dt.tz_convert(None).to_numpy(dtype="datetime64[ns]")
+
+
+def _nanos_or_none(datetimes):
+    values = datetimes.view("int64").astype(object)
+    values[np.isnat(datetimes)] = None
+    return values.tolist()
+
+
+NS_PER_DAY = 86_400_000_000_000
+
+
+class _UserTotals:
+    __slots__ = ("total", "submitted", "received", "pending", "missed", "deadlines", "starts", "seqs", "first_seq")
+
+    def __init__(self):
+        self.total = 0
+        self.submitted = 0
+        self.received = 0
+        self.pending = 0     # open tasks whose deadline is still ahead of the clock
+        self.missed = 0      # open tasks whose deadline has passed
+        self.deadlines = []  # sorted deadlines of tasks not submitted yet
+        self.starts = []     # sorted start dates
+        self.seqs = {}       # item id -> order the item was first seen in
+        self.first_seq = None  # smallest of seqs, orders users like groupby(sort=False)
+
+
+class IncrementalAnalytics:
+    """
+    Per-user counters kept up to date one list item at a time.
+
+    apply() takes only the items that were added, changed or removed (e.g. from
+    a delta sync), so a refresh costs O(changed items) instead of a pass over
+    the whole list. result() turns the counters into the same AnalyticsResult
+    compute_analytics builds from a full DataFrame.
+
+    Open deadlines still ahead of the clock sit in a min-heap. Moving the
+    clock forward pops only the deadlines that passed in between and moves
+    those tasks from pending to missed; nothing else is rescanned.
+    """
+
+    def __init__(self, rows_by_id=None, excluded_users=EXCLUDED_USERS):
+        self.excluded_users = set(excluded_users)
+        self._lock = threading.Lock()
+        self.reset(rows_by_id or {})
+
+    def reset(self, rows_by_id, now=None):
+        """
+        Rebuild every counter from a full snapshot of {item id: row}.
+        Rows are grouped per user with numpy and each user's dates sorted
+        once, rather than added one item at a time.
+        """
+        ids = list(rows_by_id)
+        rows = list(rows_by_id.values())
+        clock = _now_ns(now)
+        items, users, heap = {}, {}, []
+        if rows:
+            user_col, submitted, received, deadlines, starts = _item_columns(rows)
+            deadline_ns = deadlines.view("int64")
+            start_ns = starts.view("int64")
+            has_deadline = ~np.isnat(deadlines)
+            has_start = ~np.isnat(starts)
+            open_deadline = has_deadline & ~submitted
+            records = zip(user_col, submitted.tolist(), received.tolist(),
+                          _nanos_or_none(deadlines), _nanos_or_none(starts))
+            has_user_column = ["AssignedTo" in row for row in rows]
+            seqs = range(len(ids))
+            items = dict(zip(ids, zip(records, has_user_column, seqs, seqs)))
+
+            # Users in order of their first item; factorize keeps None as its own group
+            codes, uniques = pd.factorize(pd.Series(user_col, dtype=object), use_na_sentinel=False)
+            order = np.argsort(codes, kind="stable")
+            bounds = np.flatnonzero(np.diff(codes[order])) + 1
+            ids_array = np.asarray(ids, dtype=object)
+            for positions in np.split(order, bounds):
+                totals = _UserTotals()
+                totals.total = len(positions)
+                totals.submitted = int(submitted[positions].sum())
+                totals.received = int(received[positions].sum())
+                totals.deadlines = np.sort(deadline_ns[positions[open_deadline[positions]]]).tolist()
+                totals.starts = np.sort(start_ns[positions[has_start[positions]]]).tolist()
+                totals.missed = bisect.bisect_left(totals.deadlines, clock)
+                totals.pending = len(totals.deadlines) - totals.missed
+                totals.seqs = dict(zip(ids_array[positions].tolist(), positions.tolist()))
+                totals.first_seq = int(positions[0])
+                users[user_col[positions[0]]] = totals
+
+            upcoming = np.flatnonzero(open_deadline & (deadline_ns >= clock))
+            heap = list(zip(deadline_ns[upcoming].tolist(), upcoming.tolist(), ids_array[upcoming].tolist()))
+            heapq.heapify(heap)
+
+        with self._lock:
+            self._items = items
+            self._users = users
+            self._next_seq = self._next_token = len(ids)
+            self._with_user_column = sum(entry[1] for entry in items.values())
+            self._clock = clock
+            self._heap = heap  # (deadline, token, item id) for open tasks not yet missed
+
+    def apply(self, changes):
+        """Apply {item id: row} changes, where a row of None means the item was deleted."""
+        updated = {item_id: row for item_id, row in changes.items() if row is not None}
+        records = dict(zip(updated, _item_records(list(updated.values()))))
+        with self._lock:
+            for item_id, row in changes.items():
+                seq = self._remove(item_id)
+                if row is not None:
+                    self._add(item_id, records[item_id], "AssignedTo" in row, seq)
+
+    def __len__(self):
+        return len(self._items)
+
+    def advance(self, now=None):
+        """Move the clock to now, turning tasks whose deadline just passed from pending into missed."""
+        now_ns = _now_ns(now)
+        with self._lock:
+            self._advance(now_ns)
+
+    def due_within(self, username, within, now=None):
+        """Open tasks of a user due between now and now + within (a timedelta)."""
+        now_ns = _now_ns(now)
+        end_ns = now_ns + int(pd.Timedelta(within).value)
+        with self._lock:
+            totals = self._users.get(username)
+            if totals is None:
+                return 0
+            return bisect.bisect_left(totals.deadlines, end_ns) - bisect.bisect_left(totals.deadlines, now_ns)
+
+    def result(self, now=None):
+        """AnalyticsResult for the current counters, identical to compute_analytics on the same rows."""
+        now = now or datetime.now(UAE_TZ)
+        result = AnalyticsResult(overall=empty_overall(), teams=empty_teams(), generated_at=now)
+        now_ns = _now_ns(now)
+        with self._lock:
+            if not self._with_user_column:
+                return result
+            self._advance(now_ns)
+            # Users in order of their first item, like groupby(sort=False)
+            ordered = sorted(self._users.items(), key=lambda kv: kv[1].first_seq)
+            counts = {user: (totals.total, totals.submitted, totals.pending, totals.missed, totals.received,
+                             totals.starts[-1] if totals.starts else None)
+                      for user, totals in ordered}
+
+        overall = result.overall
+        for user, (total, submitted, pending, missed, received, _) in counts.items():
+            overall["total_users"] += user is not None
+            overall["total_tasks"] += total
+            overall["tasks_completed"] += submitted
+            overall["tasks_pending"] += pending
+            overall["tasks_missed"] += missed
+            overall["orders_received"] += received
+
+            team = result.teams["users"].setdefault(UNASSIGNED if user is None else user,
+                                                    {"tasks": 0, "submissions": 0, "pending": 0, "missed": 0})
+            team["tasks"] += total
+            team["submissions"] += submitted
+            team["pending"] += pending
+            team["missed"] += missed
+        result.teams.update(total_tasks=overall["total_tasks"], total_submissions=overall["tasks_completed"],
+                            total_pending=overall["tasks_pending"], total_missed=overall["tasks_missed"])
+
+        users = [user for user in counts if user is not None and user not in self.excluded_users]
+        for user in sorted(users):
+            total, submitted, pending, missed, received, last = counts[user]
+            result.per_user[user] = {
+                "total_tasks": total,
+                "tasks_completed": submitted,
+                "tasks_pending": pending,
+                "tasks_missed": missed,
+                "orders_received": received,
+                "last_assigned_date": None if last is None else pd.Timestamp(last, tz="UTC").tz_convert(UAE_TZ).strftime("%Y-%m-%d %H:%M"),
+            }
+
+        # Same ranking as compute_analytics: fewest pending, then longest wait, then first seen
+        default_last = now_ns - DEFAULT_DAYS_SINCE_LAST * NS_PER_DAY
+        ranking = sorted(users, key=lambda user: (
+            counts[user][2],
+            -((now_ns - (counts[user][5] if counts[user][5] is not None else default_last)) // NS_PER_DAY),
+        ))
+        result.priorities = {user: idx + 1 for idx, user in enumerate(ranking)}
+        return result
+
+    # Must be called with self._lock held
+    def _advance(self, now_ns):
+        if now_ns < self._clock:
+            self._rewind(now_ns)
+            return
+        heap = self._heap
+        while heap and heap[0][0] < now_ns:
+            _, token, item_id = heapq.heappop(heap)
+            entry = self._items.get(item_id)
+            # Entries of items changed or removed since they were pushed are skipped
+            if entry is None or entry[3] != token:
+                continue
+            totals = self._users[entry[0][0]]
+            totals.pending -= 1
+            totals.missed += 1
+        self._clock = now_ns
+
+    def _rewind(self, now_ns):
+        # The clock went backwards (tests, a corrected server clock): recount from the sorted deadlines
+        self._clock = now_ns
+        for totals in self._users.values():
+            totals.missed = bisect.bisect_left(totals.deadlines, now_ns)
+            totals.pending = len(totals.deadlines) - totals.missed
+        self._heap = [(record[3], token, item_id) for item_id, (record, _, _, token) in self._items.items()
+                      if not record[1] and record[3] is not None and record[3] >= now_ns]
+        heapq.heapify(self._heap)
+
+    def _add(self, item_id, record, has_user_column, seq=None):
+        user, submitted, received, deadline, start = record
+        if seq is None:
+            seq = self._next_seq
+            self._next_seq += 1
+        token = self._next_token
+        self._next_token += 1
+        self._items[item_id] = (record, has_user_column, seq, token)
+        self._with_user_column += has_user_column
+        totals = self._users.get(user)
+        if totals is None:
+            totals = self._users[user] = _UserTotals()
+        totals.total += 1
+        totals.submitted += submitted
+        totals.received += received
+        totals.seqs[item_id] = seq
+        if totals.first_seq is None or seq < totals.first_seq:
+            totals.first_seq = seq
+        if not submitted and deadline is not None:
+            bisect.insort(totals.deadlines, deadline)
+            if deadline < self._clock:
+                totals.missed += 1
+            else:
+                totals.pending += 1
+                heapq.heappush(self._heap, (deadline, token, item_id))
+        if start is not None:
+            bisect.insort(totals.starts, start)
+
+    def _remove(self, item_id):
+        """Take an item's contribution out of the counters, returning its sequence number."""
+        entry = self._items.pop(item_id, None)
+        if entry is None:
+            return None
+        (user, submitted, received, deadline, start), has_user_column, seq, _ = entry
+        self._with_user_column -= has_user_column
+        totals = self._users[user]
+        totals.total -= 1
+        totals.submitted -= submitted
+        totals.received -= received
+        del totals.seqs[item_id]
+        if seq == totals.first_seq:
+            # Only this user's items are scanned, and only when their first item goes
+            totals.first_seq = min(totals.seqs.values()) if totals.seqs else None
+        if not submitted and deadline is not None:
+            del totals.deadlines[bisect.bisect_left(totals.deadlines, deadline)]
+            # Its heap entry, if any, goes stale and is dropped when popped
+            if deadline < self._clock:
+                totals.missed -= 1
+            else:
+                totals.pending -= 1
+        if start is not None:
+            del totals.starts[bisect.bisect_left(totals.starts, start)]
+        if not totals.total:
+            del self._users[user]
+        return seq
+
+
+def _now_ns(now=None):
+    return pd.Timestamp(now or datetime.now(UAE_TZ)).value
+
+
+# ---------------------------------------------------------
+# LEGACY ENTRY POINTS
+# ---------------------------------------------------------
+def items_to_df(sp_items):
+    return pd.DataFrame(sp_items) if sp_items else pd.DataFrame()
+
+
+def compute_overall_analytics(df):
+    return compute_analytics(df).overall
+
+
+def compute_user_analytics(df):
+    return compute_analytics(df, excluded_users=()).per_user
+
+
+def compute_user_analytics_with_last_date(df):
+    return compute_analytics(df).per_user
+
+
+def compute_user_priority(df):
+    return compute_analytics(df).priorities
+
+
+def compute_teams_analytics(sp_items):
+    return compute_analytics(items_to_df(sp_items)).teams
@@ -1,27 +1,35 @@
 import os
-from flask import Flask, redirect, url_for, render_template, session, request, jsonify
-import requests
+import time
+import hashlib
+from functools import wraps
+from datetime import timezone
+from flask import Flask, redirect, url_for, render_template, session, request, jsonify, send_file, Response, stream_with_context
 from datetime import datetime
-import pytz
-from io import BytesIO
 from apscheduler.schedulers.background import BackgroundScheduler
-import pandas as pd
 
-from auth import login_redirect, fetch_tokens, get_graph_headers
+from auth import login_redirect, fetch_tokens, get_graph_headers, get_access_token, logout_tokens
 from functions import *  # Your existing SharePoint/Excel helper functions
+from graph_client import graph
+from photo_cache import photo_cache
+from publisher import publish_queue
+from compression import init_compression
+import metrics
+from leader import leader
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "super_secret_key")
+init_compression(app)
+metrics.init_metrics(app, graph)
 
 GRAPH_API_ENDPOINT = "https://graph.microsoft.com/v1.0"
 SITE_NAME = os.getenv("SITE_NAME", "ProposalTeam")
 LIST_NAME = os.getenv("LIST_NAME", "Proposals")
-EXCEL_FILE_NAME = "UserAnalytics.xlsx"
-
-# ---------------------------------------------------------
-# EXCLUDED USERS
-# ---------------------------------------------------------
-EXCLUDED_USERS = ["Sebin", "Shamshad", "Jaymon", "Hisham Arackal", "Althaf", "Nidal", "Nayif Muhammed S"]
+PHOTO_MAX_AGE = int(os.getenv("PHOTO_MAX_AGE", str(30 * 24 * 3600)))
+# Template events rendered before each streamed chunk is sent
+STREAM_BUFFER_EVENTS = int(os.getenv("STREAM_BUFFER_EVENTS", "40"))
+# Per-call timeouts for the concurrent /dashboard lookups
+DASHBOARD_ANALYTICS_TIMEOUT = float(os.getenv("DASHBOARD_ANALYTICS_TIMEOUT", "20"))
+DASHBOARD_ORG_TIMEOUT = float(os.getenv("DASHBOARD_ORG_TIMEOUT", "5"))
 
 # ---------------------------------------------------------
 # HELPER FUNCTIONS
@@ -38,199 +46,82 @@ def get_greeting():
     else:
         return "Hello"
 
-# ---------------------------------------------------------
-# USER PRIORITY CALCULATION
-# ---------------------------------------------------------
-def compute_user_priority(df):
-    import pytz
-    from datetime import datetime, timedelta
-
-    uae_tz = pytz.timezone("Asia/Dubai")
-    now_uae = datetime.now(uae_tz)
-
-    if df.empty or 'AssignedTo' not in df.columns:
-        return {}
-
-    # Detect Start Date column
-    start_col = None
-    for col in df.columns:
-        if col.lower().replace(" ", "") == "startdate":
-            start_col = col
-            break
-
-    # Convert date columns to datetime
-    if 'BCD' in df.columns:
-        df['BCD'] = pd.to_datetime(df['BCD'], errors='coerce', utc=True).dt.tz_convert(uae_tz)
-    if start_col:
-        df[start_col] = pd.to_datetime(df[start_col], errors='coerce', utc=True).dt.tz_convert(uae_tz)
-
-    # Exclude specific users
-    df = df[~df['AssignedTo'].isin(EXCLUDED_USERS)]
-    if df.empty:
-        return {}
-
-    # Compute active tasks per user
-    active_tasks = df[(df['SubmissionStatus'] != 'Submitted') & (df['BCD'] >= now_uae)].groupby('AssignedTo').size()
-
-    # Compute last assigned date per user
-    if start_col:
-        last_assigned_dates = df.groupby('AssignedTo')[start_col].max()
-    else:
-        last_assigned_dates = pd.Series({user: now_uae - timedelta(days=3) for user in df['AssignedTo'].unique()})
-
-    # Build user list
-    user_list = []
-    for user in df['AssignedTo'].unique():
-        count = active_tasks.get(user, 0)
-        last_date = last_assigned_dates.get(user, now_uae - timedelta(days=3))
-        days_since_last = (now_uae - last_date).days
-        user_list.append({
-            "user": user,
-            "active_tasks": count,
-            "days_since_last": days_since_last
-        })
-
-    # Sort and assign priority
-    user_list.sort(key=lambda x: (x['active_tasks'], -x['days_since_last']))
-    priorities = {u['user']: idx+1 for idx, u in enumerate(user_list)}
-    return priorities
-
-# ---------------------------------------------------------
-# USER ANALYTICS
-# ---------------------------------------------------------
-def compute_user_analytics_with_last_date(df):
-    if df.empty or 'AssignedTo' not in df.columns:
-        return {}
-
-    # Exclude specific users
-    df = df[~df['AssignedTo'].isin(EXCLUDED_USERS)]
-    if df.empty:
-        return {}
-
-    uae_tz = pytz.timezone("Asia/Dubai")
-    now_uae = datetime.now(uae_tz)
-
-    # Detect Start Date column
-    start_col = None
-    for col in df.columns:
-        if col.lower().replace(" ", "") == "startdate":
-            start_col = col
-            break
-
-    if 'BCD' in df.columns:
-        df['BCD'] = pd.to_datetime(df['BCD'], errors='coerce', utc=True).dt.tz_convert(uae_tz)
-    if start_col:
-        df[start_col] = pd.to_datetime(df[start_col], errors='coerce', utc=True).dt.tz_convert(uae_tz)
-
-    analytics = {}
-    for user, user_df in df.groupby('AssignedTo'):
-        last_assigned_date = user_df[start_col].max() if start_col else None
-        if pd.isna(last_assigned_date):
-            last_assigned_date_str = None
+def login_required(view):
+    """
+    Send requests without a signed-in user to the login page. List snapshots
+    are shared by the whole process, so a page must check this before reading them.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not get_access_token():
+            return redirect(url_for("login"))
+        return view(*args, **kwargs)
+    return wrapper
+
+def api_login_required(view):
+    """Like login_required for JSON endpoints: 401 instead of a redirect."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not get_access_token():
+            return jsonify({"error": "User not authenticated"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def snapshot_conditional(view):
+    """
+    Answer with 304 Not Modified when the list snapshot, the signed-in user and
+    the analytics time window are the same as the client's cached copy.
+    Nothing is fetched from Graph and no template is rendered in that case.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        items = get_cached_list_data(SITE_NAME, LIST_NAME, profile="analytics")
+        if not items:
+            return view(*args, **kwargs)
+
+        version, modified = snapshot_version(items)
+        # Pending/missed counts move with the clock, so pages also change every ANALYTICS_MAX_AGE
+        window = int(time.time() // ANALYTICS_MAX_AGE)
+        window_start = datetime.fromtimestamp(window * ANALYTICS_MAX_AGE, timezone.utc)
+        last_modified = max(modified, window_start)
+        principal = session.get("token_key") or ""
+        etag = hashlib.sha1(f"{version}|{window}|{principal}|{request.full_path}".encode("utf-8")).hexdigest()[:24]
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
         else:
-            last_assigned_date_str = last_assigned_date.strftime("%Y-%m-%d %H:%M")
-
-        analytics[user] = {
-            "total_tasks": len(user_df),
-            "tasks_completed": len(user_df[user_df['SubmissionStatus']=='Submitted']),
-            "tasks_pending": len(user_df[(user_df['SubmissionStatus']!='Submitted') & (user_df['BCD']>=now_uae)]),
-            "tasks_missed": len(user_df[(user_df['SubmissionStatus']!='Submitted') & (user_df['BCD']<now_uae)]),
-            "orders_received": len(user_df[user_df['Status']=='Received']) if 'Status' in df.columns else 0,
-            "last_assigned_date": last_assigned_date_str
-        }
-    return analytics
-
-# ---------------------------------------------------------
-# EXCEL FUNCTIONS
-# ---------------------------------------------------------
-def ensure_excel_file():
-    headers = get_graph_headers()
-    check_url = f"{GRAPH_API_ENDPOINT}/me/drive/root:/{EXCEL_FILE_NAME}"
-    r = requests.get(check_url, headers=headers)
-    if r.status_code == 404:
-        print("📁 Creating new UserAnalytics.xlsx in OneDrive root...")
-        excel_data = BytesIO()
-        pd.DataFrame().to_excel(excel_data, index=False)
-        excel_data.seek(0)
-        create_url = f"{GRAPH_API_ENDPOINT}/me/drive/root:/{EXCEL_FILE_NAME}:/content"
-        resp = requests.put(create_url, headers=headers, data=excel_data.read())
-        if resp.status_code in [200, 201]:
-            print("✅ Created Excel file successfully.")
+            not_modified = bool(request.if_modified_since and last_modified <= request.if_modified_since)
+        if not_modified:
+            response = Response(status=304)
         else:
-            print("❌ Failed to create Excel file:", resp.text)
-    else:
-        print("✅ Excel file exists in OneDrive root.")
-def update_user_analytics_excel(per_user, priorities=None):
-    headers = get_graph_headers()
-    ensure_excel_file()
-
-    # Filter out excluded users
-    filtered_per_user = {user: data for user, data in per_user.items() if user not in EXCLUDED_USERS}
-    if not filtered_per_user:
-        print("⚠️ No users to update in Excel.")
-        return
-
-    # Create DataFrame
-    df_per_user = pd.DataFrame.from_dict(filtered_per_user, orient="index").reset_index()
-    df_per_user.rename(columns={"index": "User"}, inplace=True)
-
-    # Add Priority if provided
-    if priorities:
-        filtered_priorities = {user: prio for user, prio in priorities.items() if user not in EXCLUDED_USERS}
-        df_per_user["Priority"] = df_per_user["User"].map(filtered_priorities)
-
-    # Ensure proper column order
-    columns_order = ["Priority", "User", "total_tasks", "tasks_completed", "tasks_pending",
-                     "tasks_missed", "orders_received", "last_assigned_date"]
-    df_per_user = df_per_user[[col for col in columns_order if col in df_per_user.columns]]
-
-    # Convert DataFrame to Excel with table formatting
-    from openpyxl import Workbook
-    from openpyxl.utils.dataframe import dataframe_to_rows
-    from openpyxl.worksheet.table import Table, TableStyleInfo
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "UserAnalytics"
-
-    # Write data rows
-    for r in dataframe_to_rows(df_per_user, index=False, header=True):
-        ws.append(r)
-
-    # Create Excel table
-    tab = Table(displayName="UserAnalyticsTable", ref=f"A1:{chr(64+len(df_per_user.columns))}{len(df_per_user)+1}")
-    style = TableStyleInfo(name="TableStyleMedium9", showFirstColumn=False,
-                           showLastColumn=False, showRowStripes=True, showColumnStripes=False)
-    tab.tableStyleInfo = style
-    ws.add_table(tab)
-
-    # Save to BytesIO
-    excel_data = BytesIO()
-    wb.save(excel_data)
-    excel_data.seek(0)
-
-    # Upload to OneDrive
-    upload_url = f"{GRAPH_API_ENDPOINT}/me/drive/root:/{EXCEL_FILE_NAME}:/content"
-    response = requests.put(upload_url, headers=headers, data=excel_data.read())
-    if response.status_code in [200, 201]:
-        print("✅ User analytics Excel updated successfully as a table.")
-    else:
-        print("❌ Failed to update Excel file:", response.text)
-
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+    return wrapper
+
+def stream_page(template_name, **context):
+    """Render a template as a stream so the first bytes go out while rows are still rendering."""
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER_EVENTS)
+    return Response(stream_with_context(stream), mimetype="text/html")
 
 # ---------------------------------------------------------
 # BACKGROUND SCHEDULER
 # ---------------------------------------------------------
+# Under gunicorn only the elected worker runs these jobs, the others read its snapshots from disk
 scheduler = BackgroundScheduler()
-scheduler.start()
 
 def background_analytics_job():
     try:
-        structured_items = get_sharepoint_list_data(SITE_NAME, LIST_NAME)
-        df = sharepoint_data_to_df(structured_items)
-        per_user = compute_user_analytics_with_last_date(df)
-        priorities = compute_user_priority(df)
-        update_user_analytics_excel(per_user, priorities)
+        with metrics.background_job("analytics_refresh"):
+            structured_items = refresh_cached_list_data(SITE_NAME, LIST_NAME, profile="analytics")
+            analytics = get_list_analytics(SITE_NAME, LIST_NAME, structured_items)
+            publish_queue.enqueue(analytics.per_user, analytics.priorities)
         print(f"[{datetime.now()}] ✅ Analytics and priorities updated.")
     except Exception as e:
         print(f"[{datetime.now()}] ❌ Error in background job: {e}")
@@ -238,6 +129,13 @@ def background_analytics_job():
 # Run every 5 minutes
 scheduler.add_job(background_analytics_job, 'interval', minutes=5)
 
+# The election runs in the process that serves requests, not at import: the
+# debug reloader's parent and a gunicorn --preload master never serve any
+@app.before_request
+def start_background_jobs():
+    if not leader.started:
+        leader.start(on_elected=scheduler.start)
+
 # ---------------------------------------------------------
 # FLASK ROUTES
 # ---------------------------------------------------------
@@ -257,60 +155,82 @@ def callback():
     code = request.args.get("code")
     if not code:
         return "Error: No code returned", 400
+    # A new sign-in may reuse this session for someone else
+    forget_session_lookups()
     if fetch_tokens(code):
         return redirect(url_for("dashboard"))
     return "Error fetching tokens", 400
 
 @app.route("/dashboard")
+@login_required
+@snapshot_conditional
 def dashboard():
-    structured_items = get_sharepoint_list_data(SITE_NAME, LIST_NAME)
-    df = sharepoint_data_to_df(structured_items)
-    per_user = compute_user_analytics_with_last_date(df)
-    priorities = compute_user_priority(df)
-    update_user_analytics_excel(per_user, priorities)
-    overall = compute_overall_analytics(df)
+    access_token = get_access_token()
+    # The list/analytics chain and the org/photo chain don't depend on each other
+    results = fan_out({
+        "analytics": (lambda: get_list_analytics(SITE_NAME, LIST_NAME), None, DASHBOARD_ANALYTICS_TIMEOUT),
+        "org": (lambda: get_org_name_and_picture(access_token), (None, DEFAULT_PROFILE_PICTURE), DASHBOARD_ORG_TIMEOUT),
+    })
+    analytics = results["analytics"]
+    if analytics is None:
+        # Better than an empty dashboard that could be cached as current
+        return Response("The dashboard data is still loading, please try again shortly.", status=503,
+                        headers={"Retry-After": "5"})
+    org_name, picture = results["org"]
+
+    # Published by the write-behind queue, the page doesn't wait for OneDrive.
+    # Only the leader publishes so workers don't race each other's uploads.
+    if leader.is_leader:
+        publish_queue.enqueue(analytics.per_user, analytics.priorities, get_graph_headers())
 
     user_info = session.get("user_info", {})
     greeting = get_greeting()
-    access_token = session.get("access_token")
-    picture = get_profile_picture(access_token)
 
     return render_template(
         "dashboard.html",
-        overall=overall,
-        per_user=per_user,
+        overall=analytics.overall,
+        per_user=analytics.per_user,
         user=user_info,
         greeting=greeting, 
         picture=picture,
-        org_name = get_graph_data(f"{GRAPH_API_ENDPOINT}/organization", access_token)["value"][0]["displayName"]
+        org_name=org_name
     )
 
 @app.route("/teams")
+@login_required
+@snapshot_conditional
 def teams():
-    sp_items = get_sharepoint_list_data(SITE_NAME, LIST_NAME)
-    analytics = compute_teams_analytics(sp_items)
+    analytics = get_list_analytics(SITE_NAME, LIST_NAME).teams
     user_info = session.get("user_info", {})
     user=user_info
     users = list(analytics.get("users", {}).keys())
-    return render_template("teams.html", analytics=analytics, users=users , user=user)
+    return stream_page("teams.html", analytics=analytics, users=users , user=user)
 
 @app.route("/user/<username>")
+@login_required
+@snapshot_conditional
 def user_analytics(username):
     if username.lower() == "dashboard":
         return redirect(url_for("dashboard"))
-    sp_items = get_sharepoint_list_data(SITE_NAME, LIST_NAME)
+    sp_items = get_cached_list_data(SITE_NAME, LIST_NAME, profile="analytics")
     analytics = compute_user_analytics_specific(sp_items, username)
-    return render_template("users_analytics.html", username=username, analytics=analytics)
+    return render_template("users_analytics.html", username=username, analytics=analytics, user=session.get("user_info", {}))
+
+@app.route("/api/users/<username>")
+@api_login_required
+def user_analytics_api(username):
+    sp_items = get_cached_list_data(SITE_NAME, LIST_NAME, profile="analytics")
+    return jsonify(compute_user_analytics_specific(sp_items, username))
 
 @app.route("/files")
 def files():
     headers = get_graph_headers()
     if not headers:
         return redirect(url_for("login"))
-    response = requests.get(f"{GRAPH_API_ENDPOINT}/me/drive/root/children", headers=headers)
+    response = graph.get("/me/drive/root/children", headers=headers)
     if response.status_code == 401:
         headers = get_graph_headers()
-        response = requests.get(f"{GRAPH_API_ENDPOINT}/me/drive/root/children", headers=headers)
+        response = graph.get("/me/drive/root/children", headers=headers)
     if response.status_code != 200:
         return f"Error fetching files: {response.json()}", response.status_code
     files = response.json().get("value", [])
@@ -325,9 +245,18 @@ def profile():
     headers = get_graph_headers()
     if not headers:
         return jsonify({"error": "User not authenticated"}), 401
-    response = requests.get(f"{GRAPH_API_ENDPOINT}/me", headers=headers)
-    if response.status_code == 200:
-        return jsonify(response.json())
+    failed = []
+
+    def load_me():
+        response = graph.get("/me", headers=headers)
+        if response.status_code == 200:
+            return response.json()
+        failed.append(response)
+
+    me = session_memo.get(current_principal(), "me", load_me, SESSION_ME_TTL)
+    if me is not None:
+        return jsonify(me)
+    response = failed[0]
     return jsonify({"error": "Failed to fetch profile", "details": response.json()}), response.status_code
 
 @app.route("/users-photos")
@@ -335,14 +264,84 @@ def users_photos():
     users = get_users_with_photos()
     return render_template("users_photos.html", users=users)
 
+@app.route("/photos/<user_id>")
+def user_photo(user_id):
+    headers = get_graph_headers()
+    if not headers:
+        return "", 401
+    entry = photo_cache.get(user_id, headers)
+    if not entry:
+        return redirect(DEFAULT_PROFILE_PICTURE)
+    thumbnail = request.args.get("size") == "thumb" and entry.get("thumbnail")
+    path = photo_cache.path(user_id, thumbnail=thumbnail)
+    mimetype = "image/jpeg" if thumbnail else entry.get("content_type", "image/jpeg")
+    etag = f"{photo_cache.version(user_id)}{'-thumb' if thumbnail else ''}"
+    # Photo URLs carry a version, so browsers may keep them for a long time
+    response = send_file(os.path.abspath(path), mimetype=mimetype, etag=etag, conditional=True, max_age=PHOTO_MAX_AGE)
+    # Employee photos sit behind sign-in, keep them out of shared proxies and CDNs
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
 @app.route("/proposals")
+@login_required
 def proposals():
-    items = get_sharepoint_list_data(SITE_NAME, LIST_NAME)
+    # Rows are loaded page by page from /api/proposals
+    items = get_cached_list_data(SITE_NAME, LIST_NAME, profile="full")
     columns = list(items[0].keys()) if items else []
-    return render_template("proposals.html", items=items, columns=columns)
+    user_info = session.get("user_info", {})
+    return stream_page("proposals.html", columns=columns, page_size=PROPOSALS_PAGE_SIZE, user=user_info)
+
+@app.route("/api/proposals")
+@api_login_required
+def proposals_api():
+    """
+    Paginated proposals from the in-memory snapshot.
+
+    Query parameters: fields, assigned_to, status, submission_status (comma
+    separated), bcd_from, bcd_to (ISO dates), sort (e.g. "-BCD,Title"), limit
+    and cursor (from the previous page's next_cursor).
+    """
+    def csv_arg(name):
+        value = request.args.get(name)
+        return [v.strip() for v in value.split(",") if v.strip()] if value else None
+
+    items = get_cached_list_data(SITE_NAME, LIST_NAME, profile="full")
+    try:
+        rows, next_cursor, total, columns = query_proposals(
+            items,
+            fields=csv_arg("fields"),
+            filters={col: csv_arg(arg) for arg, col in PROPOSAL_FILTERS.items()},
+            bcd_from=request.args.get("bcd_from"),
+            bcd_to=request.args.get("bcd_to"),
+            sort=csv_arg("sort"),
+            limit=request.args.get("limit", type=int),
+            cursor=request.args.get("cursor"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"items": rows, "next_cursor": next_cursor, "total": total, "columns": columns})
+
+@app.route("/publish/status")
+def publish_status():
+    # Signed-in users, or monitoring holding the /metrics bearer token
+    if not (get_access_token() or (metrics.METRICS_TOKEN and metrics.authorized())):
+        return jsonify({"error": "User not authenticated"}), 401
+    return jsonify(publish_queue.status())
+
+@app.route("/metrics")
+def metrics_endpoint():
+    if not metrics.authorized():
+        return "Unauthorized", 401
+    status = publish_queue.status()
+    metrics.publish_queue_depth.set(status["depth"])
+    metrics.publish_queue_lag.set(status["lag_seconds"])
+    return Response(metrics.render_metrics(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/logout")
 def logout():
+    forget_session_lookups()
+    logout_tokens()
     session.clear()
     return redirect(url_for("index"))
 
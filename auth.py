@@ -1,7 +1,10 @@
 import os
-import requests
-from flask import session, redirect
+import time
+import uuid
+import threading
+from flask import session, redirect, has_request_context
 from dotenv import load_dotenv
+from graph_client import graph
 
 load_dotenv(override=True)
 
@@ -18,6 +21,19 @@ GRAPH_API_ENDPOINT = os.getenv("GRAPH_API_ENDPOINT", "https://graph.microsoft.co
 AUTH_URL = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/authorize"
 TOKEN_URL = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token"
 
+# App-only tokens always ask for the app's configured Graph permissions
+APP_SCOPE = "https://graph.microsoft.com/.default"
+
+# Tokens are refreshed in the background once they are this close to expiring
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_REFRESH_CHECK_INTERVAL = int(os.getenv("TOKEN_REFRESH_CHECK_INTERVAL", "60"))
+# Sessions not seen for this long stop being refreshed
+TOKEN_IDLE_TIMEOUT = int(os.getenv("TOKEN_IDLE_TIMEOUT", str(12 * 3600)))
+
+# Code running outside a request uses app-only tokens. "delegated" opts in to acting as the
+# last signed-in user instead, until that user signs out or is idle for TOKEN_IDLE_TIMEOUT.
+BACKGROUND_AUTH = os.getenv("BACKGROUND_AUTH", "app")
+
 
 # ---------------------------------------------------------
 # LOGIN REDIRECT
@@ -34,6 +50,191 @@ def login_redirect():
     return redirect(auth_url)
 
 
+# ---------------------------------------------------------
+# TOKEN PROVIDER
+# ---------------------------------------------------------
+class TokenProvider:
+    """
+    Process-wide cache of access tokens with their expiry.
+
+    Delegated tokens are kept per signed-in session and app-only tokens come
+    from the client-credentials flow. A background thread refreshes every token
+    before it expires, so handing out headers never needs a network call unless
+    a token has already run out.
+    """
+
+    def __init__(self, margin=TOKEN_REFRESH_MARGIN, check_interval=TOKEN_REFRESH_CHECK_INTERVAL, idle_timeout=TOKEN_IDLE_TIMEOUT):
+        self.margin = margin
+        self.check_interval = check_interval
+        self.idle_timeout = idle_timeout
+        self._delegated = {}
+        self._app = None
+        self._last_key = None
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    # ---------------- delegated tokens ----------------
+    def store_delegated(self, tokens, key=None):
+        """Remember a token response for a session and return the session's token key."""
+        key = key or uuid.uuid4().hex
+        entry = _token_entry(tokens)
+        with self._lock:
+            previous = self._delegated.get(key, {})
+            if not entry["refresh_token"]:
+                entry["refresh_token"] = previous.get("refresh_token")
+            self._delegated[key] = entry
+            self._last_key = key
+        self._start_refresher()
+        return key
+
+    def seed_delegated(self, key, access_token, refresh_token, expires_at):
+        """Adopt tokens another worker stored in the session cookie."""
+        with self._lock:
+            if key not in self._delegated:
+                self._delegated[key] = {
+                    "access_token": access_token,
+                    "refresh_token": refresh_token,
+                    "expires_at": expires_at or 0,
+                    "last_used": time.time(),
+                }
+            self._last_key = key
+        self._start_refresher()
+
+    def delegated_token(self, key, touch=True):
+        """A session's access token. Background use passes touch=False so it doesn't keep the session alive."""
+        with self._lock:
+            entry = self._delegated.get(key)
+            if entry and touch:
+                entry["last_used"] = time.time()
+        if not entry:
+            return None
+        if entry["access_token"] and entry["expires_at"] > time.time():
+            return entry["access_token"]
+        # Already expired, nothing to do but refresh inline
+        entry = self.refresh_delegated(key)
+        return entry["access_token"] if entry else None
+
+    def delegated_entry(self, key):
+        with self._lock:
+            entry = self._delegated.get(key)
+            return dict(entry) if entry else None
+
+    def forget(self, key):
+        with self._lock:
+            self._delegated.pop(key, None)
+            if self._last_key == key:
+                self._last_key = None
+
+    @property
+    def last_delegated_key(self):
+        return self._last_key
+
+    def refresh_delegated(self, key):
+        with self._lock:
+            entry = self._delegated.get(key)
+        if not entry or not entry.get("refresh_token"):
+            return None
+        data = {
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "grant_type": "refresh_token",
+            "refresh_token": entry["refresh_token"],
+            "redirect_uri": REDIRECT_URI,
+            "scope": SCOPES,
+        }
+        response = graph.post(TOKEN_URL, data=data)
+        tokens = response.json() if response.status_code == 200 else {}
+        if not tokens.get("access_token"):
+            print("❌ Token refresh failed:", response.text)
+            return None
+        new_entry = _token_entry(tokens)
+        new_entry["refresh_token"] = new_entry["refresh_token"] or entry["refresh_token"]
+        new_entry["last_used"] = entry.get("last_used", new_entry["last_used"])
+        with self._lock:
+            if key in self._delegated:
+                self._delegated[key] = new_entry
+        return new_entry
+
+    # ---------------- app-only tokens ----------------
+    def app_token(self):
+        with self._lock:
+            entry = self._app
+        if entry and entry["expires_at"] > time.time():
+            return entry["access_token"]
+        entry = self._refresh_app()
+        return entry["access_token"] if entry else None
+
+    def _refresh_app(self):
+        if not (CLIENT_ID and CLIENT_SECRET and TENANT_ID):
+            return None
+        data = {
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "grant_type": "client_credentials",
+            "scope": APP_SCOPE,
+        }
+        # Asking for another client-credentials token has no side effects, safe to retry
+        response = graph.post(TOKEN_URL, data=data, idempotent=True)
+        tokens = response.json() if response.status_code == 200 else {}
+        if not tokens.get("access_token"):
+            print("❌ App-only token request failed:", response.text)
+            return None
+        entry = _token_entry(tokens)
+        with self._lock:
+            self._app = entry
+        self._start_refresher()
+        return entry
+
+    # ---------------- background refresh ----------------
+    def refresh_due(self):
+        """Refresh every cached token that expires within the margin."""
+        now = time.time()
+        deadline = now + self.margin
+        with self._lock:
+            idle = [key for key, entry in self._delegated.items()
+                    if now - entry.get("last_used", now) > self.idle_timeout]
+            for key in idle:
+                del self._delegated[key]
+                if self._last_key == key:
+                    self._last_key = None
+            due_keys = [key for key, entry in self._delegated.items() if entry["expires_at"] <= deadline]
+            app_due = self._app is not None and self._app["expires_at"] <= deadline
+        for key in due_keys:
+            if not self.refresh_delegated(key):
+                # Refresh token is no longer usable, the user has to sign in again
+                self.forget(key)
+        if app_due:
+            self._refresh_app()
+
+    def _start_refresher(self):
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name="token-refresher", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.refresh_due()
+            except Exception as e:
+                print(f"❌ Background token refresh failed: {e}")
+
+
+def _token_entry(tokens):
+    expires_in = int(tokens.get("expires_in", 3600))
+    return {
+        "access_token": tokens.get("access_token"),
+        "refresh_token": tokens.get("refresh_token"),
+        "expires_at": time.time() + expires_in,
+        "last_used": time.time(),
+    }
+
+
+token_provider = TokenProvider()
+
+
 # ---------------------------------------------------------
 # FETCH TOKENS
 # ---------------------------------------------------------
@@ -48,65 +249,99 @@ def fetch_tokens(code):
         "scope": SCOPES,
     }
 
-    response = requests.post(TOKEN_URL, data=token_data)
+    response = graph.post(TOKEN_URL, data=token_data)
     if response.status_code != 200:
         print("❌ Token fetch failed:", response.text)
         return False
 
     tokens = response.json()
     access_token = tokens.get("access_token")
-    refresh_token = tokens.get("refresh_token")
 
     if not access_token:
         print("❌ Missing access token:", tokens)
         return False
 
-    # ✅ Store tokens safely
-    session["access_token"] = access_token
-    session["refresh_token"] = refresh_token
+    # ✅ Cache tokens server-side, the session keeps a copy for other workers
+    key = token_provider.store_delegated(tokens, session.get("token_key"))
+    _save_session_tokens(key)
     return True
 
 
+def _save_session_tokens(key):
+    entry = token_provider.delegated_entry(key)
+    if not entry:
+        return
+    session["token_key"] = key
+    session["access_token"] = entry["access_token"]
+    session["refresh_token"] = entry["refresh_token"]
+    session["expires_at"] = entry["expires_at"]
+
+
 # ---------------------------------------------------------
 # REFRESH TOKEN
 # ---------------------------------------------------------
 def refresh_access_token():
     """Refresh expired access token using refresh token"""
-    refresh_token = session.get("refresh_token")
-    if not refresh_token:
+    key = _session_token_key()
+    if not key:
         return None
+    entry = token_provider.refresh_delegated(key)
+    if not entry:
+        return None
+    _save_session_tokens(key)
+    return entry["access_token"]
 
-    data = {
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-        "redirect_uri": REDIRECT_URI,
-        "scope": SCOPES,
-    }
-    response = requests.post(TOKEN_URL, data=data)
-    tokens = response.json()
-
-    access_token = tokens.get("access_token")
-    new_refresh_token = tokens.get("refresh_token")
-
-    if access_token:
-        session["access_token"] = access_token
-    if new_refresh_token:
-        session["refresh_token"] = new_refresh_token
 
-    return access_token
+def _session_token_key():
+    """Token key for the current session, adopting tokens another worker put in the cookie."""
+    key = session.get("token_key")
+    if not key and not session.get("refresh_token"):
+        return None
+    if not key:
+        key = uuid.uuid4().hex
+        session["token_key"] = key
+    if token_provider.delegated_entry(key) is None:
+        token_provider.seed_delegated(key, session.get("access_token"), session.get("refresh_token"), session.get("expires_at"))
+    return key
 
 
 # ---------------------------------------------------------
 # GRAPH HEADERS
 # ---------------------------------------------------------
+def get_access_token():
+    """
+    Return a valid access token without a network call on the hot path.
+
+    Inside a request this is the signed-in user's delegated token. Outside a
+    request (scheduler jobs, worker threads) it is an app-only token, unless
+    BACKGROUND_AUTH=delegated opts in to the last signed-in user's token.
+    """
+    if has_request_context():
+        key = _session_token_key()
+        if not key:
+            return None
+        token = token_provider.delegated_token(key)
+        if token and token != session.get("access_token"):
+            _save_session_tokens(key)
+        return token
+
+    if BACKGROUND_AUTH == "delegated" and token_provider.last_delegated_key:
+        token = token_provider.delegated_token(token_provider.last_delegated_key, touch=False)
+        if token:
+            return token
+    return token_provider.app_token()
+
+
 def get_graph_headers():
     """Return headers with valid access token"""
-    access_token = session.get("access_token")
-    if not access_token:
-        access_token = refresh_access_token()
-
+    access_token = get_access_token()
     if access_token:
         return {"Authorization": f"Bearer {access_token}"}
     return None
+
+
+def logout_tokens():
+    """Forget the current session's cached tokens."""
+    key = session.get("token_key")
+    if key:
+        token_provider.forget(key)
@@ -0,0 +1,205 @@
+"""
+Analytics microbenchmarks on synthetic Proposals data.
+
+    python benchmarks/bench_analytics.py --sizes 1000,10000,100000
+    python benchmarks/bench_analytics.py --sizes 10000 --compare benchmarks/results/baseline.json
+    python benchmarks/bench_analytics.py --compare old.json new.json
+
+Each function is timed over --repeat runs (median and best are kept) and run
+once more under tracemalloc for its peak memory. Results are written as JSON
+so two runs can be compared; --compare exits with status 1 when anything got
+slower than --threshold.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from functools import partial
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_items, changed_items
+from functions import flatten_fields, sharepoint_data_to_df
+from analytics import (
+    compute_analytics, compute_overall_analytics, compute_user_analytics_with_last_date,
+    compute_user_priority, compute_teams_analytics, build_user_index, IncrementalAnalytics,
+)
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+# ---------------------------------------------------------
+# BENCHMARKS
+# ---------------------------------------------------------
+def benchmarks(items, now):
+    """
+    (name, setup) pairs; setup runs untimed and returns the callable to measure.
+    Functions that take a clock get `now`, the reference the items were generated around.
+    """
+    def rows():
+        return [flatten_fields(item["fields"]) for item in items]
+
+    flat = rows()
+    df = sharepoint_data_to_df(flat)
+    by_id = {row["id"]: row for row in flat}
+    delta = {item["id"]: flatten_fields(item["fields"]) for item in changed_items(items)}
+
+    def incremental():
+        engine = IncrementalAnalytics()
+        engine.reset(by_id, now)
+        return engine
+
+    return [
+        ("flatten_fields", lambda: rows),
+        ("sharepoint_data_to_df", lambda: lambda: sharepoint_data_to_df(flat)),
+        ("compute_overall_analytics", lambda: lambda: compute_overall_analytics(df)),
+        ("compute_user_analytics_with_last_date", lambda: lambda: compute_user_analytics_with_last_date(df)),
+        ("compute_user_priority", lambda: lambda: compute_user_priority(df)),
+        ("compute_teams_analytics", lambda: lambda: compute_teams_analytics(flat)),
+        ("compute_analytics", lambda: lambda: compute_analytics(df, now=now)),
+        ("build_user_index", lambda: lambda: build_user_index(flat)),
+        ("IncrementalAnalytics.reset", lambda: incremental),
+        ("IncrementalAnalytics.apply_1pct", lambda: incremental().apply),
+        ("IncrementalAnalytics.result", lambda: partial(incremental().result, now=now)),
+    ], delta
+
+
+def measure(setup, repeat, args=()):
+    timings = []
+    for _ in range(repeat):
+        fn = setup()
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+
+    # Memory is measured on a separate run, tracemalloc slows everything down
+    fn = setup()
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "peak_bytes": peak}
+
+
+def run(sizes, users, seed, repeat, only=None, **distribution):
+    results = []
+    for size in sizes:
+        now = datetime.now(timezone.utc)
+        items = generate_items(size, users=users, seed=seed, now=now, **distribution)
+        cases, delta = benchmarks(items, now)
+        for name, setup in cases:
+            if only and not any(part in name for part in only):
+                continue
+            args = (delta,) if name.endswith("apply_1pct") else ()
+            stats = measure(setup, repeat, args)
+            results.append({"function": name, "rows": size, **stats})
+            print(f"{name:<40} {size:>9,} rows  {stats['median_s'] * 1000:>10.2f} ms  "
+                  f"{stats['peak_bytes'] / 1024 / 1024:>8.1f} MiB")
+    return results
+
+
+# ---------------------------------------------------------
+# RESULTS
+# ---------------------------------------------------------
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+    }
+
+
+def save(results, params, path=None):
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "params": params, "results": results}, f, indent=2)
+    print(f"💾 Results saved to {path}")
+    return path
+
+
+def compare(base_path, new_path, threshold):
+    """Print the change per function and size, return the entries slower than threshold."""
+    with open(base_path, encoding="utf-8") as f:
+        base = {(r["function"], r["rows"]): r for r in json.load(f)["results"]}
+    with open(new_path, encoding="utf-8") as f:
+        new = {(r["function"], r["rows"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for key in sorted(base.keys() & new.keys(), key=lambda k: (k[1], k[0])):
+        old_t, new_t = base[key]["median_s"], new[key]["median_s"]
+        old_m, new_m = base[key]["peak_bytes"], new[key]["peak_bytes"]
+        ratio = new_t / old_t if old_t else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  ❌ slower"
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            flag = "  ✅ faster"
+        print(f"{key[0]:<40} {key[1]:>9,} rows  {old_t * 1000:>9.2f} -> {new_t * 1000:>9.2f} ms "
+              f"({ratio:>5.2f}x)  {old_m / 1024 / 1024:>7.1f} -> {new_m / 1024 / 1024:>7.1f} MiB{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma separated row counts (up to 1000000)")
+    parser.add_argument("--users", type=int, default=25, help="distinct AssignedTo users")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--deadline-days", default="-90,30", help="BCD range in days around the reference date")
+    parser.add_argument("--start-days", default="-120,0", help="Start Date range in days around the reference date")
+    parser.add_argument("--skew", type=float, default=1.2, help="Zipf exponent of tasks per user, 0 spreads them evenly")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="comma separated substrings of function names to run")
+    parser.add_argument("--output", help="where to write results (default benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", nargs="+", metavar="RESULTS",
+                        help="baseline results, optionally followed by results to compare instead of running")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes a baseline and at most one other results file")
+    if args.compare and len(args.compare) == 2:
+        new_path = args.compare[1]
+    else:
+        sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+        only = [s.strip() for s in args.only.split(",")] if args.only else None
+        distribution = {
+            "deadline_days": tuple(float(d) for d in args.deadline_days.split(",")),
+            "start_days": tuple(float(d) for d in args.start_days.split(",")),
+            "skew": args.skew,
+        }
+        results = run(sizes, args.users, args.seed, max(1, args.repeat), only, **distribution)
+        params = {"sizes": sizes, "users": args.users, "seed": args.seed, "repeat": args.repeat, **distribution}
+        new_path = save(results, params, args.output)
+
+    if args.compare:
+        regressions = compare(args.compare[0], new_path, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regressions over {args.threshold:.0%}")
+            return 1
+        print("✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+# ---------------------------------------------------------
+# SYNTHETIC PROPOSALS LIST
+# ---------------------------------------------------------
+STATUSES = ["Received", "In Progress", "Lost", "On Hold", None]
+STATUS_WEIGHTS = [0.25, 0.35, 0.2, 0.1, 0.1]
+SUBMISSION_STATUSES = ["Submitted", "Not Submitted", "Draft", None]
+SUBMISSION_WEIGHTS = [0.55, 0.25, 0.1, 0.1]
+
+
+def make_users(count, seed=0):
+    rng = random.Random(seed)
+    first = ["Aisha", "Omar", "Priya", "Rahul", "Fatima", "John", "Maria", "Ali", "Sara", "Vikram", "Noor", "Anil"]
+    last = ["Khan", "Nair", "Menon", "Smith", "Haddad", "Rao", "Thomas", "Iyer", "Saleh", "George"]
+    users = []
+    while len(users) < count:
+        name = f"{rng.choice(first)} {rng.choice(last)}"
+        if name in users:
+            name = f"{name} {len(users)}"
+        users.append(name)
+    return users
+
+
+def generate_items(rows, users=25, seed=42, now=None, deadline_days=(-90, 30), start_days=(-120, 0),
+                   start_date_ratio=0.8, deadline_ratio=0.9, unassigned_ratio=0.02, skew=1.2):
+    """
+    Raw Graph list items shaped like the Proposals list, reproducible for a seed.
+
+    Work is spread over users with a Zipf-like skew (a few people carry most
+    proposals). Deadlines (BCD) and Start Dates are drawn uniformly from the
+    given day ranges around `now` (the current time by default, which is what
+    the analytics compare against), and only the given share of items has them.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    names = make_users(users, seed)
+    weights = [1 / (rank + 1) ** skew for rank in range(len(names))]
+
+    def iso(days_range):
+        offset = rng.uniform(*days_range)
+        return (now + timedelta(days=offset)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    items = []
+    for i in range(1, rows + 1):
+        fields = {
+            "@odata.etag": f"\"{i},{rng.randint(1, 9)}\"",
+            "id": str(i),
+            "ID": i,
+            "Title": f"Proposal {i:07d}",
+            "Status": rng.choices(STATUSES, STATUS_WEIGHTS)[0],
+            "SubmissionStatus": rng.choices(SUBMISSION_STATUSES, SUBMISSION_WEIGHTS)[0],
+            "Modified": iso(start_days),
+            "Author": {"displayName": rng.choice(names), "email": "author@example.com"},
+        }
+        if rng.random() >= unassigned_ratio:
+            fields["AssignedTo"] = {"displayName": rng.choices(names, weights)[0], "email": "user@example.com"}
+        if rng.random() < deadline_ratio:
+            fields["BCD"] = iso(deadline_days)
+            fields["DueDate"] = fields["BCD"]
+        if rng.random() < start_date_ratio:
+            fields["StartDate"] = iso(start_days)
+        items.append({"id": str(i), "fields": fields})
+    return items
+
+
+def changed_items(items, fraction=0.01, seed=7):
+    """A reproducible slice of items with a new submission state, as a delta sync would deliver."""
+    rng = random.Random(seed)
+    picked = rng.sample(items, max(1, int(len(items) * fraction))) if items else []
+    changed = []
+    for item in picked:
+        fields = dict(item["fields"], SubmissionStatus=rng.choices(SUBMISSION_STATUSES, SUBMISSION_WEIGHTS)[0])
+        changed.append({"id": item["id"], "fields": fields})
+    return changed
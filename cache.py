@@ -0,0 +1,181 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+# ---------------------------------------------------------
+# SNAPSHOT CACHE
+# ---------------------------------------------------------
+class _Flight:
+    """A load in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SnapshotCache:
+    """
+    Process-wide cache for expensive snapshots (e.g. SharePoint list data).
+
+    - Entries younger than `ttl` seconds are returned as is.
+    - Entries older than `ttl` but younger than `ttl + stale_ttl` are returned
+      right away while one background refresh runs (stale-while-revalidate).
+    - Concurrent misses for the same key share a single load.
+    - At most `max_entries` keys are kept, least recently used are evicted.
+
+    Loaders returning None are not cached.
+    """
+
+    def __init__(self, ttl=60, stale_ttl=600, max_entries=32):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """Return the cached value for key, loading it with loader() if needed."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, loaded_at = entry
+                age = now - loaded_at
+                if age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    if age >= self.ttl and key not in self._inflight:
+                        self._start_flight(key, loader, background=True)
+                    return value
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = self._start_flight(key, loader, background=False)
+                leader = True
+            else:
+                leader = False
+
+        if leader:
+            self._run_flight(key, loader, flight)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def put(self, key, value, age=0):
+        """
+        Store a loaded value for key. A value known to be `age` seconds old
+        (e.g. read back from disk) is served stale and refreshed like any other.
+        """
+        if value is None:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() - age)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def peek(self, key):
+        """Return the cached value for key without loading or refreshing it."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry else None
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    # Must be called with self._lock held
+    def _start_flight(self, key, loader, background):
+        flight = _Flight()
+        self._inflight[key] = flight
+        if background:
+            thread = threading.Thread(target=self._run_flight, args=(key, loader, flight), daemon=True)
+            thread.start()
+        return flight
+
+    def _run_flight(self, key, loader, flight):
+        try:
+            flight.value = loader()
+            self.put(key, flight.value)
+        except Exception as e:
+            print(f"❌ Snapshot load failed for {key}: {e}")
+            flight.error = e
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+
+# ---------------------------------------------------------
+# PER-PRINCIPAL MEMO
+# ---------------------------------------------------------
+class PrincipalMemo:
+    """
+    Small memo for lookups that belong to one signed-in principal
+    (e.g. the org name, /me, the user's own photo).
+
+    Entries are keyed by (principal, name) and each one carries its own TTL.
+    At most `max_entries` entries are kept across all principals, least
+    recently used are evicted. forget(principal) drops everything a principal
+    has, e.g. on logout. Loaders returning None are not memoized.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, principal, name, loader, ttl):
+        """Return the memoized value, calling loader() when it is missing or older than ttl."""
+        if principal is None:
+            return loader()
+        found, value = self._lookup(principal, name)
+        if found:
+            return value
+        value = loader()
+        self.put(principal, name, value, ttl)
+        return value
+
+    def peek(self, principal, name):
+        """The memoized value, None when there is none (None itself is never memoized)."""
+        if principal is None:
+            return None
+        return self._lookup(principal, name)[1]
+
+    def put(self, principal, name, value, ttl):
+        if principal is None or value is None or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[(principal, name)] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end((principal, name))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, principal):
+        """Drop every entry of a principal."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == principal]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, principal, name):
+        key = (principal, name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
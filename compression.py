@@ -0,0 +1,123 @@
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+# Streamed chunks are compressed once this many bytes are buffered
+COMPRESS_STREAM_BUFFER = int(os.getenv("COMPRESS_STREAM_BUFFER", "4096"))
+
+COMPRESSIBLE_TYPES = {
+    "text/html", "text/css", "text/plain", "text/csv", "text/javascript",
+    "application/javascript", "application/json", "image/svg+xml",
+}
+
+
+# ---------------------------------------------------------
+# ENCODING NEGOTIATION
+# ---------------------------------------------------------
+def choose_encoding(accept_encoding):
+    """Pick br or gzip from an Accept-Encoding header, None if the client takes neither."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def _new_compressor(encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # 31 = gzip container
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def compress_bytes(data, encoding):
+    compress, _, finish = _new_compressor(encoding)
+    return compress(data) + finish()
+
+
+def compress_stream(chunks, encoding):
+    """
+    Compress a streamed body chunk by chunk. Output is flushed every
+    COMPRESS_STREAM_BUFFER bytes so the browser can start rendering early.
+    """
+    compress, flush, finish = _new_compressor(encoding)
+    buffered = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            out = compress(chunk)
+            buffered += len(chunk)
+            if buffered >= COMPRESS_STREAM_BUFFER:
+                out += flush()
+                buffered = 0
+            if out:
+                yield out
+        yield finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+# ---------------------------------------------------------
+# FLASK HOOK
+# ---------------------------------------------------------
+def init_compression(app):
+    """Compress responses with gzip or brotli when the client accepts it."""
+
+    @app.after_request
+    def compress_response(response):
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES
+            or request.method == "HEAD"
+        ):
+            return response
+
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+        response.vary.add("Accept-Encoding")
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            if response.direct_passthrough:
+                return response
+            data = response.get_data()
+            if len(data) < COMPRESS_MIN_SIZE:
+                return response
+            response.set_data(compress_bytes(data, encoding))
+
+        response.headers["Content-Encoding"] = encoding
+        # The encoded body differs byte for byte, so a strong ETag no longer applies
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    return app
@@ -1,21 +1,35 @@
 import os
-import requests
+import json
+import time
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timezone
 import pytz
 from collections import defaultdict
-from auth import get_graph_headers
+from flask import has_request_context, copy_current_request_context
+from auth import get_graph_headers, get_access_token
+from cache import SnapshotCache, PrincipalMemo
+from graph_client import graph, GraphError, GraphPaginationError
+from photo_cache import photo_cache
+from snapshot_store import snapshot_store, SNAPSHOT_STORE
+from metrics import timed, request_timings, adopt_request_timings
+from workbook_reader import workbook_reader
+from workbook_writer import WorkbookWriter
+from leader import leader
+from analytics import (
+    AnalyticsResult, EXCLUDED_USERS, compute_analytics, compute_overall_analytics, compute_user_analytics,
+    compute_user_analytics_with_last_date, compute_user_priority, compute_teams_analytics,
+    build_user_index, user_analytics_from_index, IncrementalAnalytics,
+)
 
 GRAPH_API_ENDPOINT = "https://graph.microsoft.com/v1.0"
 
 def get_graph_data(endpoint, access_token):
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(endpoint, headers=headers)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Graph API error ({response.status_code}): {response.text}")
-        return None
+    return graph.get_json(endpoint, headers=headers)
 
 def get_my_user_id():
     """
@@ -24,7 +38,7 @@ def get_my_user_id():
     headers = get_graph_headers()
     if not headers:
         return None
-    resp = requests.get(f"{GRAPH_API_ENDPOINT}/me", headers=headers)
+    resp = graph.get("/me", headers=headers)
     if resp.status_code == 200:
         return resp.json().get("id")
     return None
@@ -33,35 +47,240 @@ def get_my_user_id():
 # ---------------------------------------------------------
 def get_site_id(site_name):
     headers = get_graph_headers()
-    url = f"{GRAPH_API_ENDPOINT}/sites/hamdaz1.sharepoint.com:/sites/{site_name}"
-    resp = requests.get(url, headers=headers)
+    resp = graph.get(f"/sites/hamdaz1.sharepoint.com:/sites/{site_name}", headers=headers)
     if resp.status_code == 200:
         return resp.json().get("id")
     return None
 
 def get_list_id(site_id, list_name):
     headers = get_graph_headers()
-    url = f"{GRAPH_API_ENDPOINT}/sites/{site_id}/lists"
-    resp = requests.get(url, headers=headers)
+    resp = graph.get(f"/sites/{site_id}/lists", headers=headers)
     if resp.status_code == 200:
         for l in resp.json().get("value", []):
             if l.get("name") == list_name:
                 return l.get("id")
     return None
 
-def get_list_items(site_id, list_id):
+_site_list_ids = {}
+
+def get_site_and_list_ids(site_name, list_name):
+    """
+    Resolve the site id and list id in one $batch round trip.
+    Ids never change, so they are remembered for the life of the process.
+    """
+    key = (site_name, list_name)
+    if key in _site_list_ids:
+        return _site_list_ids[key]
+
+    headers = get_graph_headers()
+    site_path = f"/sites/hamdaz1.sharepoint.com:/sites/{site_name}"
+    site_resp, lists_resp = graph.batch([
+        {"url": f"{site_path}?$select=id"},
+        {"url": f"{site_path}:/lists?$select=id,name"},
+    ], headers=headers)
+    if site_resp["status"] != 200 or lists_resp["status"] != 200:
+        return None, None
+
+    site_id = site_resp["body"].get("id")
+    list_id = next((l.get("id") for l in lists_resp["body"].get("value", []) if l.get("name") == list_name), None)
+    if site_id and list_id:
+        _site_list_ids[key] = (site_id, list_id)
+    return site_id, list_id
+
+# ---------------------------------------------------------
+# FIELD PROJECTION PROFILES
+# ---------------------------------------------------------
+# Internal name of the Start Date column, SharePoint encodes spaces as _x0020_
+LIST_START_DATE_FIELD = os.getenv("LIST_START_DATE_FIELD", "StartDate")
+
+# Columns each kind of caller reads from the list; select=None asks for every column
+LIST_PROFILES = {
+    "analytics": {
+        "select": ["ID", "Modified", "Title", "AssignedTo", "SubmissionStatus", "Status", "BCD", LIST_START_DATE_FIELD, "DueDate"],
+        "expand": ["AssignedTo"],
+    },
+    "full": {
+        "select": None,
+        "expand": ["AssignedTo", "Author", "Editor"],
+    },
+}
+
+def list_fields_query(profile):
+    """The expand=fields(...) query option for a projection profile."""
+    if profile not in LIST_PROFILES:
+        raise ValueError(f"unknown list profile: {profile}")
+    spec = LIST_PROFILES[profile]
+    options = []
+    if spec["select"]:
+        options.append("$select=" + ",".join(spec["select"]))
+    if spec["expand"]:
+        options.append("$expand=" + ",".join(spec["expand"]))
+    return f"expand=fields({';'.join(options)})"
+
+def list_items_url(site_id, list_id, profile):
+    query = list_fields_query(profile)
+    if LIST_PROFILES[profile]["select"]:
+        # Item metadata (createdBy, parentReference, ...) is never read when fields are projected
+        query = f"$select=id&{query}"
+    return f"/sites/{site_id}/lists/{list_id}/items?{query}"
+
+def get_list_items(site_id, list_id, profile="full"):
+    """
+    Return every item of a list with the columns of the given projection profile.
+    Raises GraphPaginationError if a page fails instead of returning a partial list.
+    """
+    if LIST_FETCH_PARTITIONS > 1:
+        return get_list_items_parallel(site_id, list_id, LIST_FETCH_PARTITIONS, profile)
+    headers = get_graph_headers()
+    return graph.get_all(list_items_url(site_id, list_id, profile), headers=headers)
+
+# ---------------------------------------------------------
+# PARALLEL PARTITIONED LIST FETCH
+# ---------------------------------------------------------
+LIST_FETCH_PARTITIONS = int(os.getenv("LIST_FETCH_PARTITIONS", "1"))
+LIST_FETCH_CONCURRENCY = int(os.getenv("LIST_FETCH_CONCURRENCY", "4"))
+
+def _get_max_item_id(site_id, list_id, headers):
+    url = f"/sites/{site_id}/lists/{list_id}/items?$select=id&$expand=fields($select=ID)&$orderby=fields/ID desc&$top=1"
+    resp = graph.get(url, headers={**headers, "Prefer": "HonorNonIndexedQueriesWarningMayFailRandomly"})
+    if resp.status_code != 200:
+        raise GraphError(f"Graph API error ({resp.status_code}) reading the highest item id: {resp.text}", resp.status_code, graph.url(url))
+    items = resp.json().get("value", [])
+    return int(items[0]["id"]) if items else 0
+
+def get_list_items_parallel(site_id, list_id, partitions=LIST_FETCH_PARTITIONS, profile="full"):
+    """
+    Fetch a list as `partitions` item ID ranges in parallel and merge them in ID order.
+    Each range is paged on its own, so a full load takes about as long as the
+    largest range instead of every page one after another.
+    """
     headers = get_graph_headers()
-    url = f"{GRAPH_API_ENDPOINT}/sites/{site_id}/lists/{list_id}/items?expand=fields($expand=AssignedTo,Author,Editor)"
-    items = []
-    while url:
-        resp = requests.get(url, headers=headers)
-        if resp.status_code != 200:
-            break
-        data = resp.json()
-        items.extend(data.get("value", []))
-        url = data.get("@odata.nextLink")
+    max_id = _get_max_item_id(site_id, list_id, headers)
+    if max_id == 0:
+        return []
+
+    step = max(1, -(-max_id // partitions))
+    ranges = [(low, min(low + step, max_id + 1)) for low in range(1, max_id + 1, step)]
+    range_headers = {**headers, "Prefer": "HonorNonIndexedQueriesWarningMayFailRandomly"}
+
+    def fetch_range(bounds):
+        low, high = bounds
+        url = f"{list_items_url(site_id, list_id, profile)}&$filter=fields/ID ge {low} and fields/ID lt {high}"
+        return graph.get_all(url, headers=range_headers)
+
+    with ThreadPoolExecutor(max_workers=min(LIST_FETCH_CONCURRENCY, len(ranges))) as pool:
+        chunks = list(pool.map(fetch_range, ranges))
+
+    items = [item for chunk in chunks for item in chunk]
+    items.sort(key=lambda item: int(item.get("id", 0)))
     return items
 
+# ---------------------------------------------------------
+# SHAREPOINT LIST DELTA SYNC
+# ---------------------------------------------------------
+# "delta" keeps a local copy of each list and only pulls changes after the
+# first load, "full" walks every page on every call.
+LIST_SYNC_MODE = os.getenv("LIST_SYNC_MODE", "delta")
+
+_delta_state = {}
+_delta_locks = defaultdict(threading.Lock)
+# IncrementalAnalytics fed from each delta sync, created on first use
+_incremental = {}
+
+def _apply_delta_page(items, page, changed=None):
+    for item in page:
+        item_id = item.get("id")
+        if not item_id:
+            continue
+        if changed is not None:
+            changed.add(item_id)
+        if "@removed" in item or "deleted" in item:
+            items.pop(item_id, None)
+        else:
+            items[item_id] = item
+
+def get_list_items_delta(site_id, list_id, profile="full"):
+    """
+    Return list items using a Graph delta query.
+    Each projection profile keeps its own delta link and local copy.
+    The first call walks the whole list and stores the delta link, later calls
+    only fetch the items that were added, changed or deleted since then.
+    Raises GraphError if the sync could not be completed, the stored snapshot
+    is left untouched in that case.
+    """
+    key = (site_id, list_id, profile)
+    start_url = f"/sites/{site_id}/lists/{list_id}/items/delta?{list_fields_query(profile)}"
+    with _delta_locks[key]:
+        state = _delta_state.get(key)
+        if state:
+            items = dict(state["items"])
+            url = state["delta_link"]
+        else:
+            items = {}
+            url = start_url
+
+        headers = get_graph_headers()
+        delta_link = None
+        changed = set()
+        resynced = state is None
+        while url:
+            resp = graph.get(url, headers=headers)
+            if resp.status_code == 410 and state:
+                # Delta token expired, start over with a full sync
+                print("⚠️ Delta token expired, resyncing list from scratch.")
+                _delta_state.pop(key, None)
+                state = None
+                items = {}
+                url = start_url
+                changed.clear()
+                resynced = True
+                continue
+            if resp.status_code != 200:
+                raise GraphPaginationError(
+                    f"Graph API error ({resp.status_code}) during delta sync: {resp.text}",
+                    resp.status_code, graph.url(url), items_read=len(items),
+                )
+            data = resp.json()
+            _apply_delta_page(items, data.get("value", []), changed)
+            url = data.get("@odata.nextLink")
+            delta_link = data.get("@odata.deltaLink")
+
+        if delta_link:
+            _delta_state[key] = {"items": items, "delta_link": delta_link}
+            if resynced:
+                # A full load is analysed with compute_analytics, counters only pay off for deltas
+                _incremental.pop(key, None)
+            elif changed:
+                incremental = _incremental.get(key)
+                if incremental is None:
+                    _incremental[key] = IncrementalAnalytics(_rows_by_id(items))
+                else:
+                    incremental.apply({i: flatten_fields(items[i].get("fields", {})) if i in items else None for i in changed})
+        return list(items.values())
+
+def _rows_by_id(items):
+    return {item_id: flatten_fields(item.get("fields", {})) for item_id, item in items.items()}
+
+def get_incremental_analytics(site_id, list_id, profile="analytics"):
+    """
+    IncrementalAnalytics kept in step with a list's delta sync, so analytics
+    only absorb the items each sync changed. The counters are built the first
+    time a sync brings changes; None until then, compute_analytics is cheaper
+    for a snapshot nothing has been applied to.
+    """
+    with _delta_locks[(site_id, list_id, profile)]:
+        return _incremental.get((site_id, list_id, profile))
+
+def reset_list_delta(site_id=None, list_id=None):
+    """Forget stored delta links so the next sync reloads the whole list."""
+    if site_id and list_id:
+        for key in [k for k in _delta_state if k[:2] == (site_id, list_id)]:
+            _delta_state.pop(key, None)
+            _incremental.pop(key, None)
+    else:
+        _delta_state.clear()
+        _incremental.clear()
+
 def flatten_fields(fields):
     flat = {}
     for k, v in fields.items():
@@ -73,16 +292,162 @@ def flatten_fields(fields):
             flat[k] = v
     return flat
 
-def get_sharepoint_list_data(site_name, list_name):
-    site_id = get_site_id(site_name)
-    if not site_id:
-        return []
-    list_id = get_list_id(site_id, list_name)
-    if not list_id:
+def get_sharepoint_list_data(site_name, list_name, profile="full"):
+    site_id, list_id = get_site_and_list_ids(site_name, list_name)
+    if not site_id or not list_id:
         return []
 
-    items = get_list_items(site_id, list_id)
-    return [flatten_fields(item.get("fields", {})) for item in items]
+    if LIST_SYNC_MODE == "delta":
+        items = get_list_items_delta(site_id, list_id, profile)
+    else:
+        items = get_list_items(site_id, list_id, profile)
+    rows = [flatten_fields(item.get("fields", {})) for item in items]
+    save_list_snapshot(site_name, list_name, profile, site_id, list_id, rows)
+    return rows
+
+# ---------------------------------------------------------
+# ON-DISK SNAPSHOTS
+# ---------------------------------------------------------
+_warm_started = set()
+
+def save_list_snapshot(site_name, list_name, profile, site_id, list_id, rows):
+    """Persist a freshly loaded snapshot (and its delta link) for the next process start."""
+    if not SNAPSHOT_STORE or not rows:
+        return
+    state = _delta_state.get((site_id, list_id, profile))
+    delta_link = state["delta_link"] if LIST_SYNC_MODE == "delta" and state else None
+    try:
+        snapshot_store.save((site_name, list_name, profile), rows, snapshot_version(rows)[0],
+                            delta_link=delta_link, site_id=site_id, list_id=list_id)
+    except Exception as e:
+        print(f"⚠️ Could not save list snapshot: {e}")
+
+def warm_start_list_cache(site_name, list_name, profile="full"):
+    """
+    Seed the snapshot cache from disk once per process and key.
+    The stored rows are served right away and refreshed in the background on
+    first use; the stored delta link lets that refresh pull only the changes.
+    """
+    key = (site_name, list_name, profile)
+    if not SNAPSHOT_STORE or key in _warm_started:
+        return False
+    _warm_started.add(key)
+    rows, meta = snapshot_store.load(key)
+    if not rows:
+        return False
+    list_cache.put(key, rows, age=list_cache.ttl)
+
+    _adopt_stored_state(site_name, list_name, profile, rows, meta, replace=False)
+    print(f"✅ Warm-started {list_name} ({profile}) with {len(rows)} rows from disk.")
+    return True
+
+def load_shared_list_snapshot(site_name, list_name, profile="full"):
+    """
+    Rows another worker stored recently enough to use instead of calling Graph, else None.
+    Followers trust the store for a whole cache lifetime since the leader keeps
+    it fresh; the leader only takes what was refreshed within the last TTL.
+    """
+    if not SNAPSHOT_STORE:
+        return None
+    key = (site_name, list_name, profile)
+    max_age = LIST_CACHE_TTL if leader.is_leader else LIST_CACHE_TTL + LIST_CACHE_STALE_TTL
+    age = snapshot_store.age(key)
+    if age is None or age >= max_age:
+        return None
+    rows, meta = snapshot_store.load(key)
+    if not rows:
+        return None
+    _adopt_stored_state(site_name, list_name, profile, rows, meta, replace=True)
+    return rows
+
+def _adopt_stored_state(site_name, list_name, profile, rows, meta, replace):
+    # The stored delta link lets this process continue syncing from where the writer left off
+    site_id, list_id = meta.get("site_id"), meta.get("list_id")
+    if not site_id or not list_id:
+        return
+    _site_list_ids.setdefault((site_name, list_name), (site_id, list_id))
+    ids = [row.get("id") or row.get("ID") for row in rows]
+    if not meta.get("delta_link") or not all(ids):
+        return
+    key = (site_id, list_id, profile)
+    with _delta_locks[key]:
+        if key in _delta_state and not replace:
+            return
+        _delta_state[key] = {
+            "items": {str(i): {"id": str(i), "fields": row} for i, row in zip(ids, rows)},
+            "delta_link": meta["delta_link"],
+        }
+        # Built again from the adopted rows once a delta brings changes
+        _incremental.pop(key, None)
+
+# ---------------------------------------------------------
+# SHARED LIST SNAPSHOT CACHE
+# ---------------------------------------------------------
+LIST_CACHE_TTL = int(os.getenv("LIST_CACHE_TTL", "60"))
+LIST_CACHE_STALE_TTL = int(os.getenv("LIST_CACHE_STALE_TTL", "600"))
+LIST_CACHE_MAX_ENTRIES = int(os.getenv("LIST_CACHE_MAX_ENTRIES", "16"))
+
+list_cache = SnapshotCache(ttl=LIST_CACHE_TTL, stale_ttl=LIST_CACHE_STALE_TTL, max_entries=LIST_CACHE_MAX_ENTRIES)
+
+def get_cached_list_data(site_name, list_name, profile="full"):
+    """
+    Same rows as get_sharepoint_list_data, served from the process-wide snapshot cache.
+    Stale snapshots are returned immediately while one background refresh runs.
+    Every projection profile is cached separately. Snapshots other workers
+    just stored on disk are used before going to Graph.
+    """
+    def load():
+        shared = load_shared_list_snapshot(site_name, list_name, profile)
+        if shared is not None:
+            return shared
+        return get_sharepoint_list_data(site_name, list_name, profile) or None
+
+    key = (site_name, list_name, profile)
+    if list_cache.peek(key) is None:
+        warm_start_list_cache(site_name, list_name, profile)
+    # Background refreshes need the caller's session to build Graph headers
+    if has_request_context():
+        load = copy_current_request_context(load)
+    return list_cache.get(key, load) or []
+
+def refresh_cached_list_data(site_name, list_name, profile="full"):
+    """Reload the list from Graph and replace the cached snapshot."""
+    items = get_sharepoint_list_data(site_name, list_name, profile)
+    list_cache.put((site_name, list_name, profile), items or None)
+    return items
+
+# Pending/missed depend on the clock, so results are recomputed after this many seconds
+ANALYTICS_MAX_AGE = int(os.getenv("ANALYTICS_MAX_AGE", "60"))
+
+_analytics_memo = {}
+_analytics_lock = threading.Lock()
+
+def get_list_analytics(site_name, list_name, items=None):
+    """
+    AnalyticsResult for the cached list snapshot.
+    Computed once per snapshot and reused by every route until the snapshot
+    changes or the result is older than ANALYTICS_MAX_AGE. In delta mode the
+    numbers come from the incrementally maintained counters.
+    """
+    if items is None:
+        items = get_cached_list_data(site_name, list_name, profile="analytics")
+    key = (site_name, list_name)
+    with _analytics_lock:
+        memo = _analytics_memo.get(key)
+        if memo and memo[0] is items and time.monotonic() - memo[1] < ANALYTICS_MAX_AGE:
+            return memo[2]
+    incremental = None
+    if LIST_SYNC_MODE == "delta" and (site_name, list_name) in _site_list_ids:
+        incremental = get_incremental_analytics(*_site_list_ids[(site_name, list_name)])
+    # The counters can be a sync ahead of `items`, only trust them when they agree
+    with timed("analytics"):
+        if incremental is not None and len(incremental) == len(items):
+            result = incremental.result()
+        else:
+            result = compute_analytics(sharepoint_data_to_df(items))
+    with _analytics_lock:
+        _analytics_memo[key] = (items, time.monotonic(), result)
+    return result
 
 # ---------------------------------------------------------
 # SHAREPOINT DATA TO DF
@@ -103,148 +468,190 @@ def sharepoint_data_to_df(structured_items):
 # ---------------------------------------------------------
 # ANALYTICS FUNCTIONS
 # ---------------------------------------------------------
-def compute_overall_analytics(df):
-    if df.empty:
-        return {"total_users":0,"total_tasks":0,"tasks_completed":0,"tasks_pending":0,"tasks_missed":0,"orders_received":0}
-    uae_tz = pytz.timezone("Asia/Dubai")
-    now_uae = datetime.now(uae_tz)
-    df['BCD'] = pd.to_datetime(df['BCD'], errors='coerce', utc=True).dt.tz_convert(uae_tz)
-    total_users = df['AssignedTo'].nunique()
-    total_tasks = len(df)
-    tasks_completed = len(df[df['SubmissionStatus']=='Submitted'])
-    tasks_pending = len(df[(df['SubmissionStatus']!='Submitted') & (df['BCD']>=now_uae)])
-    tasks_missed = len(df[(df['SubmissionStatus']!='Submitted') & (df['BCD']<now_uae)])
-    orders_received = len(df[df['Status']=='Received']) if 'Status' in df.columns else 0
-    return {
-        "total_users": total_users,
-        "total_tasks": total_tasks,
-        "tasks_completed": tasks_completed,
-        "tasks_pending": tasks_pending,
-        "tasks_missed": tasks_missed,
-        "orders_received": orders_received
-    }
-
-def compute_user_analytics(df):
-    if df.empty or 'AssignedTo' not in df.columns:
-        return {}
-
-    uae_tz = pytz.timezone("Asia/Dubai")
-    now_uae = datetime.now(uae_tz)
-
-    # Convert dates to timezone-aware
-    if 'BCD' in df.columns:
-        df['BCD'] = pd.to_datetime(df['BCD'], errors='coerce', utc=True).dt.tz_convert(uae_tz)
-    if 'Start Date' in df.columns:
-        df['Start Date'] = pd.to_datetime(df['Start Date'], errors='coerce', utc=True).dt.tz_convert(uae_tz)
-
-    analytics = {}
-    for user, user_df in df.groupby('AssignedTo'):
-        # Last assigned date = latest Start Date
-        last_assigned_date = None
-        if 'Start Date' in user_df.columns and not user_df['Start Date'].isna().all():
-            last_assigned_date = user_df['Start Date'].max()
-            last_assigned_date = last_assigned_date.strftime("%Y-%m-%d %H:%M")
-
-        analytics[user] = {
-            "total_tasks": len(user_df),
-            "tasks_completed": len(user_df[user_df['SubmissionStatus']=='Submitted']),
-            "tasks_pending": len(user_df[(user_df['SubmissionStatus']!='Submitted') & (user_df['BCD']>=now_uae)]),
-            "tasks_missed": len(user_df[(user_df['SubmissionStatus']!='Submitted') & (user_df['BCD']<now_uae)]),
-            "orders_received": len(user_df[user_df['Status']=='Received']) if 'Status' in df.columns else 0,
-            "last_assigned_date": last_assigned_date
-        }
+_snapshot_memos = defaultdict(dict)
+_snapshot_memo_lock = threading.Lock()
+
+def memo_per_snapshot(name, sp_items, build):
+    """
+    Build something derived from a list snapshot once and reuse it until the
+    snapshot changes. Snapshots are compared by identity, the cache hands out
+    the same list object until it refreshes.
+    """
+    memos = _snapshot_memos[name]
+    key = id(sp_items)
+    with _snapshot_memo_lock:
+        memo = memos.get(key)
+        if memo and memo[0] is sp_items:
+            return memo[1]
+    value = build(sp_items)
+    with _snapshot_memo_lock:
+        # Only the latest few snapshots are ever asked for
+        if len(memos) >= 4:
+            memos.pop(next(iter(memos)))
+        memos[key] = (sp_items, value)
+    return value
 
-    return analytics
+# ---------------------------------------------------------
+# SNAPSHOT VERSIONS
+# ---------------------------------------------------------
+_version_first_seen = {}
+
+def _hash_snapshot(sp_items):
+    digest = hashlib.sha1()
+    for row in sp_items:
+        # SharePoint bumps the item etag on every change, fall back to the whole row without one
+        marker = row.get("@odata.etag") or row.get("Modified")
+        if marker:
+            digest.update(f"{row.get('id')}|{marker}\n".encode("utf-8"))
+        else:
+            digest.update(json.dumps(row, sort_keys=True, default=str).encode("utf-8"))
+    version = digest.hexdigest()[:20]
+    with _snapshot_memo_lock:
+        if version not in _version_first_seen:
+            if len(_version_first_seen) >= 64:
+                _version_first_seen.pop(next(iter(_version_first_seen)))
+            _version_first_seen[version] = datetime.now(timezone.utc).replace(microsecond=0)
+        return version, _version_first_seen[version]
+
+def snapshot_version(sp_items):
+    """
+    Content version of a list snapshot and when that content was first seen.
+    Refreshes that bring back identical data keep the same version.
+    """
+    return memo_per_snapshot("version", sp_items, _hash_snapshot)
 
+def get_user_index(sp_items):
+    """Per-user row index for a snapshot, built once and reused until the snapshot changes."""
+    return memo_per_snapshot("user_index", sp_items, build_user_index)
 
 def compute_user_analytics_specific(sp_items, username):
-    uae_tz = pytz.timezone("Asia/Dubai")
-    now_uae = datetime.now(uae_tz)
-    user_items = [i for i in sp_items if i.get("AssignedTo")==username]
-    tasks= submissions= pending= missed =0
-    for item in user_items:
-        submission_status = (item.get("SubmissionStatus") or "").lower()
-        bcd_str = item.get("BCD")
-        try:
-            bcd_dt = datetime.fromisoformat(bcd_str) if bcd_str else None
-            if bcd_dt:
-                bcd_dt = uae_tz.localize(bcd_dt)
-        except: bcd_dt=None
-        tasks +=1
-        if submission_status=='submitted':
-            submissions +=1
-        elif bcd_dt and bcd_dt < now_uae:
-            missed +=1
-        else:
-            pending +=1
-    return {"tasks":tasks,"submissions":submissions,"pending":pending,"missed":missed}
-
-def compute_teams_analytics(sp_items):
-    uae_tz = pytz.timezone("Asia/Dubai")
-    now = datetime.now(uae_tz)
-    overall = {"total_tasks":0,"total_submissions":0,"total_pending":0,"total_missed":0,"users":{}}
-    for item in sp_items:
-        overall["total_tasks"] +=1
-        user = item.get("AssignedTo") or "Unassigned"
-        if user not in overall["users"]:
-            overall["users"][user] = {"tasks":0,"submissions":0,"pending":0,"missed":0}
-        overall["users"][user]["tasks"] +=1
-        bcd_str = item.get("BCD")
-        submission_status = (item.get("SubmissionStatus") or "").lower()
-        try:
-            bcd_dt = datetime.fromisoformat(bcd_str) if bcd_str else None
-            if bcd_dt:
-                bcd_dt = uae_tz.localize(bcd_dt)
-        except: bcd_dt=None
-        if submission_status=="submitted":
-            overall["total_submissions"] +=1
-            overall["users"][user]["submissions"] +=1
-        if bcd_dt and bcd_dt >= now:
-            overall["total_pending"] +=1
-            overall["users"][user]["pending"] +=1
-        if bcd_dt and bcd_dt < now and submission_status!="submitted":
-            overall["total_missed"] +=1
-            overall["users"][user]["missed"] +=1
-    return overall
+    return user_analytics_from_index(get_user_index(sp_items), username)
+
+# ---------------------------------------------------------
+# PROPOSALS QUERY API
+# ---------------------------------------------------------
+PROPOSALS_PAGE_SIZE = int(os.getenv("PROPOSALS_PAGE_SIZE", "50"))
+PROPOSALS_MAX_PAGE_SIZE = int(os.getenv("PROPOSALS_MAX_PAGE_SIZE", "500"))
+
+# Query parameter -> list column for the equality filters
+PROPOSAL_FILTERS = {"assigned_to": "AssignedTo", "status": "Status", "submission_status": "SubmissionStatus"}
+
+def _build_proposals_frame(sp_items):
+    df = pd.DataFrame(sp_items) if sp_items else pd.DataFrame()
+    columns = list(df.columns)
+    # Parsed once per snapshot for BCD range filters and date sorting
+    bcd = pd.to_datetime(df["BCD"], errors="coerce", utc=True) if "BCD" in df.columns else pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns, UTC]")
+    return df.astype(object).where(df.notna(), None), bcd, columns
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(json.dumps({"o": offset}).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    """Offset stored in a cursor, raises ValueError for anything that isn't one of ours."""
+    if not cursor:
+        return 0
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(padded.encode("ascii"))).get("o")
+    except (ValueError, AttributeError):
+        raise ValueError("invalid cursor")
+    # bool is a subclass of int, {"o": true} isn't a cursor either
+    if type(offset) is not int or offset < 0:
+        raise ValueError("invalid cursor")
+    return offset
+
+def query_proposals(sp_items, fields=None, filters=None, bcd_from=None, bcd_to=None, sort=None, limit=None, cursor=None):
+    """
+    Filter, sort, project and page list rows from the in-memory snapshot.
+
+    filters maps list columns to accepted values, sort is a list of column
+    names where a leading "-" means descending. Returns the page of rows,
+    the cursor of the next page (None on the last page), the number of rows
+    matching the filters and all available columns.
+    Raises ValueError for unknown columns, bad dates or a bad cursor.
+    """
+    df, bcd, columns = memo_per_snapshot("proposals_frame", sp_items, _build_proposals_frame)
+    limit = max(1, min(limit or PROPOSALS_PAGE_SIZE, PROPOSALS_MAX_PAGE_SIZE))
+    offset = decode_cursor(cursor)
+
+    mask = pd.Series(True, index=df.index)
+    for col, values in (filters or {}).items():
+        if not values:
+            continue
+        if col not in df.columns:
+            mask &= False
+            continue
+        mask &= df[col].isin(values)
+    if bcd_from:
+        mask &= bcd >= _utc_timestamp(bcd_from)
+    if bcd_to:
+        mask &= bcd <= _utc_timestamp(bcd_to)
+    matched = df[mask]
+
+    if sort:
+        by, ascending = [], []
+        for spec in sort:
+            col = spec.lstrip("-")
+            if col not in df.columns:
+                raise ValueError(f"unknown sort column: {col}")
+            by.append(col)
+            ascending.append(not spec.startswith("-"))
+        sort_frame = pd.DataFrame({
+            col: bcd[matched.index] if col == "BCD" else _sort_column(matched[col])
+            for col in by
+        })
+        order = sort_frame.sort_values(by, ascending=ascending, na_position="last", kind="stable").index
+        matched = matched.loc[order]
+
+    if fields:
+        unknown = [col for col in fields if col not in df.columns]
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(unknown)}")
+        matched = matched[fields]
+
+    page = matched.iloc[offset:offset + limit]
+    next_cursor = encode_cursor(offset + limit) if offset + limit < len(matched) else None
+    return page.to_dict("records"), next_cursor, len(matched), columns
+
+def _sort_column(values):
+    # Numeric columns sort as numbers, anything else as case-insensitive text
+    numeric = pd.to_numeric(values, errors="coerce")
+    if numeric.notna().sum() == values.notna().sum():
+        return numeric
+    return values.map(lambda v: None if v is None else str(v).lower())
+
+def _utc_timestamp(value):
+    ts = pd.Timestamp(value)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
 
 # ---------------------------------------------------------
 # EXCEL / ONEDRIVE ANALYTICS
 # ---------------------------------------------------------
 def get_file_id(file_path):
     headers = get_graph_headers()
-    url = f"{GRAPH_API_ENDPOINT}{file_path}"
-    resp = requests.get(url, headers=headers)
+    resp = graph.get(file_path, headers=headers)
     return resp.json().get("id") if resp.status_code==200 else None
 
+# Tables and rows are read from one cached download of the workbook, see workbook_reader.py
 def get_excel_tables(file_path):
-    file_id = get_file_id(file_path)
-    if not file_id: return []
-    url = f"{GRAPH_API_ENDPOINT}/me/drive/items/{file_id}/workbook/tables"
-    headers = get_graph_headers()
-    resp = requests.get(url, headers=headers)
-    return resp.json().get("value", []) if resp.status_code==200 else []
+    return [{"name": name} for name in workbook_reader.tables(file_path)]
 
 def get_table_data(file_path, table_name):
-    file_id = get_file_id(file_path)
-    if not file_id: return []
-    url = f"{GRAPH_API_ENDPOINT}/me/drive/items/{file_id}/workbook/tables/{table_name}/rows"
-    headers = get_graph_headers()
-    resp = requests.get(url, headers=headers)
-    return resp.json().get("value", []) if resp.status_code==200 else []
+    table = workbook_reader.table(file_path, table_name)
+    if not table: return []
+    return [{"index": i, "values": [values]} for i, values in enumerate(table["rows"])]
 
 def get_users_analytics(file_path):
-    tables = get_excel_tables(file_path)
     analytics = defaultdict(lambda: {"total_tasks":0,"active_tasks":0})
     today = datetime.now().date()
-    for table in tables:
-        rows = get_table_data(file_path, table.get("name"))
-        for row in rows:
-            values = row.get("values",[[]])[0]
+    for table in workbook_reader.tables(file_path).values():
+        for values in table["rows"]:
             if len(values)<4: continue
             user, task_name, due_date, status = values[:4]
             analytics[user]["total_tasks"] +=1
             try:
-                due_dt = datetime.strptime(due_date,"%Y-%m-%d").date()
+                # openpyxl hands back date cells as datetimes, text cells stay strings
+                due_dt = due_date.date() if isinstance(due_date, datetime) else datetime.strptime(due_date,"%Y-%m-%d").date()
                 if due_dt>=today and status.lower()!="completed":
                     analytics[user]["active_tasks"] +=1
             except: pass
@@ -253,36 +660,152 @@ def get_users_analytics(file_path):
 # ---------------------------------------------------------
 # USERS WITH PHOTOS
 # ---------------------------------------------------------
-import base64
-from flask import session
+from flask import session, url_for
+
+DEFAULT_PROFILE_PICTURE = "/static/default_profile.png"
+
+def photo_url(user_id, thumbnail=False):
+    """
+    URL of a user's cached photo, or None if they have no photo.
+    The URL carries the photo version so browsers can cache it for a long time.
+    """
+    version = photo_cache.version(user_id)
+    if not version:
+        return None
+    if thumbnail:
+        return url_for("user_photo", user_id=user_id, v=version, size="thumb")
+    return url_for("user_photo", user_id=user_id, v=version)
 
 def get_users_with_photos():
-    access_token = session.get("access_token")
+    access_token = get_access_token()
     if not access_token: return []
     headers = {'Authorization':f'Bearer {access_token}'}
-    resp = requests.get(f"{GRAPH_API_ENDPOINT}/users?$select=id,displayName,mail", headers=headers)
+    resp = graph.get("/users?$select=id,displayName,mail", headers=headers)
     if resp.status_code !=200: return []
     users = resp.json().get("value", [])
+    # Only users whose cached photo is missing or due for revalidation hit Graph
+    stale = [user['id'] for user in users if not photo_cache.is_fresh(user['id'])]
+    photo_cache.refresh(stale, headers)
     for user in users:
-        uid = user['id']
-        photo_resp = requests.get(f"{GRAPH_API_ENDPOINT}/users/{uid}/photo/$value", headers=headers)
-        if photo_resp.status_code==200:
-            photo_b64 = base64.b64encode(photo_resp.content).decode('utf-8')
-            user['photo'] = f"data:image/jpeg;base64,{photo_b64}"
-        else:
-            user['photo'] = None
+        user['photo'] = photo_url(user['id'], thumbnail=True)
     return users
 
 def get_profile_picture(access_token, user_id=None):
-    url = f"https://graph.microsoft.com/v1.0/me/photo/$value" if not user_id else f"https://graph.microsoft.com/v1.0/users/{user_id}/photo/$value"
     headers = {"Authorization": f"Bearer {access_token}"}
-    resp = requests.get(url, headers=headers)
-    if resp.status_code == 200:
-        encoded = base64.b64encode(resp.content).decode("utf-8")
-        return f"data:image/jpeg;base64,{encoded}"
-    return "/static/default_profile.png"
+    if not user_id:
+        user_id = session.get("user_id") or get_my_user_id()
+        if not user_id:
+            return DEFAULT_PROFILE_PICTURE
+        session["user_id"] = user_id
+    photo_cache.get(user_id, headers)
+    return photo_url(user_id) or DEFAULT_PROFILE_PICTURE
+
+def get_org_name_and_picture(access_token):
+    """
+    The organization name and the signed-in user's photo URL.
+
+    The org name and user id come from one $batch call and the photo from the
+    photo cache. Each is memoized for the signed-in session on its own, so a
+    failed /organization lookup is retried without holding back the others.
+    """
+    principal = current_principal()
+    org_name = session_memo.peek(principal, "org_name")
+    user_id = session_memo.peek(principal, "user_id")
+    if org_name is None or user_id is None:
+        fetched_org, fetched_id = _fetch_org_and_id(access_token, org=org_name is None, me=user_id is None)
+        org_name = org_name or fetched_org
+        user_id = user_id or fetched_id
+        session_memo.put(principal, "org_name", org_name, SESSION_ORG_TTL)
+        session_memo.put(principal, "user_id", user_id, SESSION_ORG_TTL)
+    if not user_id:
+        return org_name, DEFAULT_PROFILE_PICTURE
+    picture = session_memo.get(principal, "picture", lambda: get_profile_picture(access_token, user_id),
+                               SESSION_PHOTO_TTL)
+    return org_name, picture
+
+def _fetch_org_and_id(access_token, org=True, me=True):
+    """(org name, user id) in one $batch call, None for whatever wasn't asked for or couldn't be read."""
+    headers = {"Authorization": f"Bearer {access_token}"}
+    names = [name for name, wanted in (("org", org), ("me", me)) if wanted]
+    urls = {"org": "/organization?$select=displayName", "me": "/me?$select=id"}
+    responses = dict(zip(names, graph.batch([{"url": urls[name]} for name in names], headers=headers)))
+    org_name = user_id = None
+    if responses.get("org", {}).get("status") == 200:
+        orgs = responses["org"]["body"].get("value", [])
+        org_name = orgs[0].get("displayName") if orgs else None
+    if responses.get("me", {}).get("status") == 200:
+        user_id = responses["me"]["body"].get("id")
+    return org_name, user_id
+
+# ---------------------------------------------------------
+# PER-SESSION MEMO
+# ---------------------------------------------------------
+# How long per-user lookups are reused within a signed-in session
+SESSION_ORG_TTL = int(os.getenv("SESSION_ORG_TTL", "3600"))
+SESSION_ME_TTL = int(os.getenv("SESSION_ME_TTL", "300"))
+SESSION_PHOTO_TTL = int(os.getenv("SESSION_PHOTO_TTL", "900"))
+SESSION_MEMO_MAX_ENTRIES = int(os.getenv("SESSION_MEMO_MAX_ENTRIES", "2048"))
+
+session_memo = PrincipalMemo(max_entries=SESSION_MEMO_MAX_ENTRIES)
+
+def current_principal():
+    """Memo key of the signed-in session (its token key), None outside a signed-in request."""
+    if not has_request_context():
+        return None
+    return session.get("token_key")
+
+def forget_session_lookups():
+    """Drop everything memoized for the current session, e.g. on logout."""
+    principal = current_principal()
+    if principal:
+        session_memo.forget(principal)
+
+
+# ---------------------------------------------------------
+# CONCURRENT FAN-OUT
+# ---------------------------------------------------------
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "8"))
+FANOUT_TIMEOUT = float(os.getenv("FANOUT_TIMEOUT", "10"))
+
+# Shared so calls abandoned after a timeout can't pile up threads
+_fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
 
+def fan_out(calls, timeout=FANOUT_TIMEOUT):
+    """
+    Run independent calls at the same time and return {name: result}.
 
+    calls maps a name to (fn, fallback) or (fn, fallback, timeout). Every call
+    runs with the caller's request context and counts towards its
+    Server-Timing. A call that raises, or is still running when its timeout
+    (counted from the start of the fan-out) passes, yields its fallback; it
+    is left to finish in the background.
+    """
+    timings = request_timings()
+    started = time.monotonic()
+    futures = {}
+    for name, spec in calls.items():
+        fn = spec[0]
+        if has_request_context():
+            fn = copy_current_request_context(fn)
+
+        def run(fn=fn):
+            adopt_request_timings(timings)
+            return fn()
+        futures[name] = _fanout_pool.submit(run)
+
+    results = {}
+    for name, spec in calls.items():
+        fallback = spec[1]
+        limit = spec[2] if len(spec) > 2 else timeout
+        try:
+            results[name] = futures[name].result(timeout=max(0.0, started + limit - time.monotonic()))
+        except FuturesTimeout:
+            print(f"⚠️ {name} took longer than {limit:g}s, using fallback.")
+            results[name] = fallback
+        except Exception as e:
+            print(f"❌ {name} failed: {e}")
+            results[name] = fallback
+    return results
 
 # ---------------------------------------------------------
 # EXCEL / ONEDRIVE READ & UPDATE FUNCTIONS
@@ -292,8 +815,7 @@ def get_excel_file_id(file_path):
     Get the file ID of an Excel file from OneDrive or SharePoint.
     """
     headers = get_graph_headers()
-    url = f"{GRAPH_API_ENDPOINT}{file_path}"
-    resp = requests.get(url, headers=headers)
+    resp = graph.get(file_path, headers=headers)
     return resp.json().get("id") if resp.status_code == 200 else None
 
 def get_excel_table_rows(file_path, table_name):
@@ -301,105 +823,54 @@ def get_excel_table_rows(file_path, table_name):
     Get all rows of a table from an Excel file.
     Returns a list of lists (each row is a list of cell values).
     """
-    file_id = get_excel_file_id(file_path)
-    if not file_id:
-        return []
-    
-    url = f"{GRAPH_API_ENDPOINT}/me/drive/items/{file_id}/workbook/tables/{table_name}/rows"
-    headers = get_graph_headers()
-    resp = requests.get(url, headers=headers)
-    if resp.status_code == 200:
-        rows = resp.json().get("value", [])
-        return [row.get("values", [[]])[0] for row in rows]
-    return []
+    table = workbook_reader.table(file_path, table_name)
+    return [list(values) for values in table["rows"]] if table else []
 
 def add_excel_row(file_path, table_name, row_values):
     """
     Add a new row to an Excel table.
     row_values: list of values corresponding to the table columns
     """
-    file_id = get_excel_file_id(file_path)
-    if not file_id:
-        return False
-
-    url = f"{GRAPH_API_ENDPOINT}/me/drive/items/{file_id}/workbook/tables/{table_name}/rows/add"
-    headers = get_graph_headers()
-    data = {
-        "values": [row_values]
-    }
-    resp = requests.post(url, headers=headers, json=data)
-    return resp.status_code == 201 or resp.status_code == 200
+    return _write_excel_rows(file_path, lambda writer: writer.add_rows(table_name, [row_values]), use_session=False)
 
 def update_excel_row(file_path, table_name, row_index, row_values):
     """
     Update an existing row in an Excel table by index (0-based).
     """
-    file_id = get_excel_file_id(file_path)
-    if not file_id:
-        return False
+    return _write_excel_rows(file_path, lambda writer: writer.update_rows(table_name, {row_index: row_values}), use_session=False)
 
-    url = f"{GRAPH_API_ENDPOINT}/me/drive/items/{file_id}/workbook/tables/{table_name}/rows/{row_index}"
-    headers = get_graph_headers()
-    data = {"values": [row_values]}
-    resp = requests.patch(url, headers=headers, json=data)
-    return resp.status_code == 200
+def add_excel_rows(file_path, table_name, rows):
+    """
+    Add many rows to an Excel table in chunked rows/add calls over one workbook session.
+    """
+    return _write_excel_rows(file_path, lambda writer: writer.add_rows(table_name, rows))
+
+def update_excel_rows(file_path, table_name, rows_by_index):
+    """
+    Update many rows of an Excel table, given as {0-based index: values}.
+    Consecutive rows are written with one range PATCH over one workbook session.
+    """
+    return _write_excel_rows(file_path, lambda writer: writer.update_rows(table_name, rows_by_index))
+
+def _write_excel_rows(file_path, write, use_session=True):
+    # A single-row write is one call, a session would only add two more
+    writer = WorkbookWriter(file_path)
+    try:
+        if use_session:
+            writer.open()
+        write(writer)
+        return True
+    except GraphError as e:
+        print(f"❌ Excel write failed: {e}")
+        return False
+    finally:
+        writer.close()
+        workbook_reader.invalidate(file_path)
 
 # Example usage:
 # file_path = "/me/drive/root:/Documents/tasks.xlsx"
 # table_name = "Tasks"
 # all_rows = get_excel_table_rows(file_path, table_name)
 # add_excel_row(file_path, table_name, ["Sebin", "New Task", "2025-10-10", "Pending"])
+# add_excel_rows(file_path, table_name, [["Sebin", "Task A", "2025-10-10", "Pending"], ["Althaf", "Task B", "2025-10-11", "Pending"]])
 # update_excel_row(file_path, table_name, 2, ["Sebin", "Updated Task", "2025-10-12", "Completed"])
-
-from io import BytesIO
-
-
-GRAPH_API_ENDPOINT = "https://graph.microsoft.com/v1.0"
-EXCEL_FILE_NAME = "UserAnalytics.xlsx"
-
-
-def ensure_excel_file():
-    """Ensure the user analytics Excel file exists in OneDrive root."""
-    headers = get_graph_headers()
-    check_url = f"{GRAPH_API_ENDPOINT}/me/drive/root:/{EXCEL_FILE_NAME}"
-    r = requests.get(check_url, headers=headers)
-
-    if r.status_code == 404:
-        print("📁 Creating new User_Analytics.xlsx in OneDrive root...")
-        excel_data = BytesIO()
-        pd.DataFrame().to_excel(excel_data, index=False)
-        excel_data.seek(0)
-
-        create_url = f"{GRAPH_API_ENDPOINT}/me/drive/root:/{EXCEL_FILE_NAME}:/content"
-        resp = requests.put(create_url, headers=headers, data=excel_data.read())
-
-        if resp.status_code in [200, 201]:
-            print("✅ Created User_Analytics.xlsx successfully.")
-        else:
-            print("❌ Failed to create Excel file:", resp.text)
-    else:
-        print("✅ Excel file exists in OneDrive root.")
-
-
-def update_user_analytics_excel(per_user):
-    """Upload user analytics data to the Excel file in OneDrive root."""
-    headers = get_graph_headers()
-    ensure_excel_file()
-
-    # Convert per_user dict to DataFrame
-    df_per_user = pd.DataFrame.from_dict(per_user, orient="index").reset_index()
-    df_per_user.rename(columns={"index": "User"}, inplace=True)
-
-    # Save to Excel in memory
-    excel_data = BytesIO()
-    df_per_user.to_excel(excel_data, index=False)
-    excel_data.seek(0)
-
-    # Upload file to OneDrive root
-    upload_url = f"{GRAPH_API_ENDPOINT}/me/drive/root:/{EXCEL_FILE_NAME}:/content"
-    response = requests.put(upload_url, headers=headers, data=excel_data.read())
-
-    if response.status_code in [200, 201]:
-        print("✅ User analytics Excel updated successfully.")
-    else:
-        print("❌ Failed to update Excel file:", response.text)
\ No newline at end of file
@@ -0,0 +1,279 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+GRAPH_API_ENDPOINT = os.getenv("GRAPH_API_ENDPOINT", "https://graph.microsoft.com/v1.0")
+
+GRAPH_CONNECT_TIMEOUT = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "5"))
+GRAPH_READ_TIMEOUT = float(os.getenv("GRAPH_READ_TIMEOUT", "30"))
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "4"))
+GRAPH_BACKOFF_BASE = float(os.getenv("GRAPH_BACKOFF_BASE", "0.5"))
+GRAPH_BACKOFF_MAX = float(os.getenv("GRAPH_BACKOFF_MAX", "30"))
+GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "20"))
+GRAPH_BATCH_CONCURRENCY = int(os.getenv("GRAPH_BATCH_CONCURRENCY", "4"))
+
+# Graph accepts at most 20 sub-requests per $batch call
+GRAPH_BATCH_SIZE = 20
+
+# Throttling and transient server errors worth another try
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Methods that are safe to send twice; other methods are only retried when Graph
+# says it did not run the request (429, or 503 with Retry-After)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE"}
+
+
+# ---------------------------------------------------------
+# ERRORS
+# ---------------------------------------------------------
+class GraphError(Exception):
+    """A Graph call that failed after all retries."""
+
+    def __init__(self, message, status_code=None, url=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.url = url
+
+
+class GraphPaginationError(GraphError):
+    """A paged read that stopped part way through."""
+
+    def __init__(self, message, status_code=None, url=None, items_read=0):
+        super().__init__(message, status_code, url)
+        self.items_read = items_read
+
+
+def _redact(url):
+    """A URL without its query string, pre-authenticated download links carry their token there."""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}" if parts.query else url
+
+
+def _redact_text(error, url):
+    """An error message with the URL's query string taken out, requests errors quote it."""
+    query = urlsplit(url).query
+    return str(error).replace("?" + query, "") if query else str(error)
+
+
+def _retryable(status, idempotent, has_retry_after):
+    """Whether a response is worth another try for a request that is (or isn't) safe to repeat."""
+    if status not in RETRY_STATUSES:
+        return False
+    if idempotent:
+        return True
+    # Throttled requests were not processed; 503 with Retry-After means Graph asked for a retry
+    return status == 429 or (status == 503 and has_retry_after)
+
+
+# ---------------------------------------------------------
+# GRAPH CLIENT
+# ---------------------------------------------------------
+class GraphClient:
+    """
+    Shared Microsoft Graph client.
+
+    Keeps one pooled keep-alive session for the whole process, applies connect
+    and read timeouts, and retries throttled (429) or transient (5xx) responses
+    with jittered exponential backoff that honours Retry-After. POSTs are
+    only retried when Graph can't have applied them, so writes such as
+    rows/add are never sent twice.
+    """
+
+    def __init__(self, base_url=GRAPH_API_ENDPOINT, connect_timeout=GRAPH_CONNECT_TIMEOUT,
+                 read_timeout=GRAPH_READ_TIMEOUT, max_retries=GRAPH_MAX_RETRIES,
+                 backoff_base=GRAPH_BACKOFF_BASE, backoff_max=GRAPH_BACKOFF_MAX, pool_size=GRAPH_POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+        # Called as hook(method, url, status, seconds, response_bytes) after every attempt
+        self.hooks = []
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def url(self, path):
+        """Turn a Graph path like /me/drive into a full URL, full URLs are left alone."""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}{path}"
+
+    def request(self, method, path, headers=None, idempotent=None, **kwargs):
+        """
+        Send a request and return the final response.
+        Throttled and transient failures are retried, anything else is returned
+        to the caller unchanged. Requests that aren't idempotent (POST unless
+        the caller passes idempotent=True) are only retried when they can't
+        have been applied: a failed connect, 429, or 503 with Retry-After.
+        """
+        url = self.url(path)
+        kwargs.setdefault("timeout", self.timeout)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                resp = self.session.request(method, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._run_hooks(method, url, "error", time.perf_counter() - started, None)
+                # A read timeout or dropped connection may come after the server applied the request
+                never_sent = isinstance(e, requests.ConnectTimeout)
+                if attempt >= self.max_retries or not (idempotent or never_sent):
+                    raise GraphError(f"{method} {_redact(url)} failed: {_redact_text(e, url)}", url=_redact(url)) from e
+                delay = self._backoff(attempt)
+                print(f"⚠️ Graph {method} {_redact(url)} failed ({_redact_text(e, url)}), retrying in {delay:.1f}s")
+            else:
+                self._run_hooks(method, url, resp.status_code, time.perf_counter() - started, len(resp.content))
+                delay = self._retry_after(resp)
+                if attempt >= self.max_retries or not _retryable(resp.status_code, idempotent, delay is not None):
+                    return resp
+                if delay is None:
+                    delay = self._backoff(attempt)
+                print(f"⚠️ Graph {method} {_redact(url)} returned {resp.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, path, headers=None, **kwargs):
+        return self.request("GET", path, headers=headers, **kwargs)
+
+    def post(self, path, headers=None, idempotent=False, **kwargs):
+        return self.request("POST", path, headers=headers, idempotent=idempotent, **kwargs)
+
+    def put(self, path, headers=None, **kwargs):
+        return self.request("PUT", path, headers=headers, **kwargs)
+
+    def patch(self, path, headers=None, **kwargs):
+        return self.request("PATCH", path, headers=headers, **kwargs)
+
+    def get_json(self, path, headers=None, **kwargs):
+        """GET a Graph resource and return its JSON body, or None if it does not exist."""
+        resp = self.get(path, headers=headers, **kwargs)
+        if resp.status_code == 200:
+            return resp.json()
+        print(f"Graph API error ({resp.status_code}): {resp.text}")
+        return None
+
+    def get_all(self, path, headers=None):
+        """
+        Follow @odata.nextLink and return every item of a collection.
+        Raises GraphPaginationError instead of returning a partial list.
+        """
+        items = []
+        url = path
+        while url:
+            resp = self.get(url, headers=headers)
+            if resp.status_code != 200:
+                message = f"Graph API error ({resp.status_code}) after {len(items)} items: {resp.text}"
+                if items:
+                    raise GraphPaginationError(message, resp.status_code, self.url(url), items_read=len(items))
+                raise GraphError(message, resp.status_code, self.url(url))
+            data = resp.json()
+            items.extend(data.get("value", []))
+            url = data.get("@odata.nextLink")
+        return items
+
+    def batch(self, sub_requests, headers=None):
+        """
+        Run many Graph requests through JSON $batch.
+
+        sub_requests is a list of dicts like {"method": "GET", "url": "/me"} with
+        URLs relative to the API version. They are packed 20 per $batch call,
+        the calls run concurrently, and the sub-responses come back in the same
+        order as a list of {"status", "headers", "body"} dicts. Throttled
+        sub-requests are retried like normal requests.
+        """
+        chunks = [sub_requests[i:i + GRAPH_BATCH_SIZE] for i in range(0, len(sub_requests), GRAPH_BATCH_SIZE)]
+        if not chunks:
+            return []
+        if len(chunks) == 1:
+            return self._send_batch(chunks[0], headers)
+        with ThreadPoolExecutor(max_workers=min(GRAPH_BATCH_CONCURRENCY, len(chunks))) as pool:
+            results = pool.map(lambda chunk: self._send_batch(chunk, headers), chunks)
+            return [resp for chunk_result in results for resp in chunk_result]
+
+    def _send_batch(self, chunk, headers):
+        responses = [None] * len(chunk)
+        pending = list(range(len(chunk)))
+        attempt = 0
+        while pending:
+            batch_requests = []
+            for i in pending:
+                sub = dict(chunk[i], id=str(i))
+                sub.setdefault("method", "GET")
+                batch_requests.append(sub)
+            # A batch of reads can be resent, one with writes in it only when Graph didn't run it
+            read_only = all(sub["method"].upper() in IDEMPOTENT_METHODS for sub in batch_requests)
+            resp = self.post("/$batch", headers=headers, idempotent=read_only, json={"requests": batch_requests})
+            if resp.status_code != 200:
+                raise GraphError(f"Graph $batch failed ({resp.status_code}): {resp.text}", resp.status_code, self.url("/$batch"))
+
+            retry, delay = [], 0.0
+            for sub in resp.json().get("responses", []):
+                i = int(sub["id"])
+                responses[i] = {"status": sub.get("status"), "headers": sub.get("headers", {}), "body": sub.get("body")}
+                wait = self._retry_after_value(sub.get("headers", {}).get("Retry-After"))
+                idempotent = chunk[i].get("method", "GET").upper() in IDEMPOTENT_METHODS
+                if attempt < self.max_retries and _retryable(sub.get("status"), idempotent, wait is not None):
+                    retry.append(i)
+                    delay = max(delay, wait if wait is not None else self._backoff(attempt))
+            if retry:
+                print(f"⚠️ Graph $batch: {len(retry)} sub-requests throttled, retrying in {delay:.1f}s")
+                time.sleep(delay)
+            pending = retry
+            attempt += 1
+        return responses
+
+    def _run_hooks(self, method, url, status, seconds, nbytes):
+        for hook in self.hooks:
+            try:
+                hook(method, url, status, seconds, nbytes)
+            except Exception as e:
+                print(f"⚠️ Graph hook failed: {e}")
+
+    def _backoff(self, attempt):
+        # Full jitter keeps many workers from retrying in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_after(self, resp):
+        return self._retry_after_value(resp.headers.get("Retry-After"))
+
+    def _retry_after_value(self, value):
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+        # Small jitter on top so parallel callers don't all wake at once
+        return max(0.0, min(seconds, self.backoff_max)) + random.uniform(0, self.backoff_base)
+
+
+graph = GraphClient()
@@ -0,0 +1,110 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, every process acts as leader there
+    fcntl = None
+
+load_dotenv(override=True)
+
+# "leader": one process per host runs background jobs, "all": every process does, "off": none do
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "leader").lower()
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", os.path.join(".cache", "leader.lock"))
+LEADER_RETRY_SECONDS = float(os.getenv("LEADER_RETRY_SECONDS", "15"))
+
+
+# ---------------------------------------------------------
+# LEADER ELECTION
+# ---------------------------------------------------------
+class LeaderElection:
+    """
+    Picks one process among the gunicorn workers on a host to run background jobs.
+
+    The leader is whoever holds an exclusive flock on `path`. The lock is held
+    for the life of the process and released by the OS when it exits, so a
+    follower retrying every `retry` seconds takes over after a crash.
+    Call start() from the process that serves requests: leadership is tied to
+    the pid that won it, so a forked child never inherits it.
+    """
+
+    def __init__(self, path=LEADER_LOCK_FILE, mode=SCHEDULER_MODE, retry=LEADER_RETRY_SECONDS):
+        self.path = path
+        self.mode = mode
+        self.retry = retry
+        self._leader_pid = None
+        self._started_pid = None
+        self._file = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def start(self, on_elected=None):
+        """
+        Try to become leader now, and keep trying in the background until it works.
+        Only the first call in a process does anything.
+        """
+        with self._start_lock:
+            if self.started:
+                return self
+            self._started_pid = os.getpid()
+        # Callbacks and threads from before a fork belong to the parent
+        self._callbacks = [on_elected] if on_elected else []
+        self._thread = None
+        if self.mode == "off":
+            return self
+        if self.mode == "all" or fcntl is None:
+            if fcntl is None and self.mode != "all":
+                print("⚠️ fcntl not available, every process will run background jobs.")
+            self._elected()
+            return self
+        if not self._try_acquire() and self._thread is None:
+            self._thread = threading.Thread(target=self._campaign, name="leader-election", daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def started(self):
+        return self._started_pid == os.getpid()
+
+    @property
+    def is_leader(self):
+        return self._leader_pid == os.getpid()
+
+    def _campaign(self):
+        stop = threading.Event()
+        while not stop.wait(self.retry):
+            if self._try_acquire():
+                return
+
+    def _try_acquire(self):
+        with self._lock:
+            if self.is_leader:
+                return True
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            handle = open(self.path, "a+")
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+            handle.seek(0)
+            handle.truncate()
+            handle.write(str(os.getpid()))
+            handle.flush()
+            # Keeping the file open keeps the lock
+            self._file = handle
+        self._elected()
+        return True
+
+    def _elected(self):
+        self._leader_pid = os.getpid()
+        print(f"👑 Process {os.getpid()} is running background jobs.")
+        for callback in self._callbacks:
+            callback()
+
+
+leader = LeaderElection()
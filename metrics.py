@@ -0,0 +1,273 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from flask import g, request, has_app_context, has_request_context, before_render_template, template_rendered
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+# ---------------------------------------------------------
+# METRIC TYPES
+# ---------------------------------------------------------
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key)) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{self._labels(key)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_value(self, key, state):
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{self._labels(key, ('le', _number(bound)))} {cumulative}")
+        lines.append(f"{self.name}_bucket{self._labels(key, ('le', '+Inf'))} {state['count']}")
+        lines.append(f"{self.name}_sum{self._labels(key)} {_number(state['sum'])}")
+        lines.append(f"{self.name}_count{self._labels(key)} {state['count']}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+REGISTRY = []
+
+# ---------------------------------------------------------
+# METRICS
+# ---------------------------------------------------------
+http_request_seconds = Histogram("app_http_request_duration_seconds", "Time spent handling HTTP requests.",
+                                 ["endpoint", "method", "status"])
+phase_seconds = Histogram("app_phase_duration_seconds", "Time spent in analytics, rendering, Excel and publish phases.",
+                          ["phase"])
+graph_request_seconds = Histogram("app_graph_request_duration_seconds", "Latency of Microsoft Graph calls, per attempt.",
+                                  ["method", "resource", "status"])
+graph_response_bytes = Histogram("app_graph_response_bytes", "Size of Microsoft Graph response bodies.",
+                                 ["resource"], buckets=SIZE_BUCKETS)
+graph_requests_per_http_request = Histogram("app_graph_requests_per_http_request", "Graph calls made while serving one page.",
+                                            ["endpoint"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34))
+job_seconds = Histogram("app_background_job_duration_seconds", "Duration of background jobs.", ["job"],
+                        buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+job_runs = Counter("app_background_job_runs_total", "Background job runs by outcome.", ["job", "result"])
+job_last_success = Gauge("app_background_job_last_success_timestamp_seconds", "Unix time of the last successful run.", ["job"])
+publish_queue_depth = Gauge("app_publish_queue_depth", "Analytics snapshots waiting to be published to OneDrive.")
+publish_queue_lag = Gauge("app_publish_queue_lag_seconds", "Age of the oldest unpublished analytics snapshot.")
+
+
+# ---------------------------------------------------------
+# RECORDING
+# ---------------------------------------------------------
+# Worker threads of a request add to the same totals
+_timing_lock = threading.Lock()
+
+
+def _timings():
+    """Per-request phase totals as {phase: (seconds, calls, bytes)}, None outside a request."""
+    if not has_app_context():
+        return None
+    if "server_timing" not in g:
+        g.server_timing = {}
+    return g.server_timing
+
+
+def request_timings():
+    """The current request's totals, for handing to threads working on its behalf."""
+    return _timings()
+
+
+def adopt_request_timings(timings):
+    """Make a worker thread's measurements count towards the request that started it."""
+    if timings is not None and has_app_context():
+        g.server_timing = timings
+
+
+def _add_timing(phase, seconds, count=1, nbytes=0):
+    timings = _timings()
+    if timings is None:
+        return
+    with _timing_lock:
+        total, calls, size = timings.get(phase, (0.0, 0, 0))
+        timings[phase] = (total + seconds, calls + count, size + nbytes)
+
+
+def record_phase(phase, seconds, count=1):
+    phase_seconds.observe(seconds, phase=phase)
+    _add_timing(phase, seconds, count)
+
+
+@contextmanager
+def timed(phase):
+    """Time a block, adding it to the phase histogram and the request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+
+def record_graph_call(method, url, status, seconds, nbytes):
+    """GraphClient hook: one observation per attempt, including retried ones."""
+    parts = [p for p in urlsplit(url).path.split("/") if p]
+    # /v1.0/sites/... -> "sites", keeps label cardinality to a handful of values
+    resource = parts[1].split(":")[0].split("(")[0] if len(parts) > 1 else "other"
+    graph_request_seconds.observe(seconds, method=method, resource=resource, status=status)
+    if nbytes is not None:
+        graph_response_bytes.observe(nbytes, resource=resource)
+    _add_timing("graph", seconds, 1, nbytes or 0)
+
+
+@contextmanager
+def background_job(name):
+    """Time a background job and count how it ended."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        job_runs.inc(job=name, result="error")
+        raise
+    else:
+        job_runs.inc(job=name, result="success")
+        job_last_success.set(round(time.time(), 3), job=name)
+    finally:
+        job_seconds.observe(time.perf_counter() - start, job=name)
+
+
+def server_timing_header(total=None):
+    timings = _timings() or {}
+    parts = []
+    with _timing_lock:
+        items = list(timings.items())
+    for phase, (seconds, calls, size) in items:
+        desc = f"{calls} calls, {size} bytes" if phase == "graph" else f"{calls} calls"
+        parts.append(f'{phase};dur={seconds * 1000:.1f};desc="{desc}"')
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def authorized():
+    """/metrics is open unless METRICS_TOKEN is set, then it needs that bearer token."""
+    if not METRICS_TOKEN or not has_request_context():
+        return True
+    return request.headers.get("Authorization") == f"Bearer {METRICS_TOKEN}"
+
+
+# ---------------------------------------------------------
+# FLASK HOOK
+# ---------------------------------------------------------
+def init_metrics(app, graph_client=None):
+    """Time every request, send Server-Timing and collect Graph calls and template renders."""
+    if graph_client is not None:
+        graph_client.hooks.append(record_graph_call)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        started = g.get("request_started")
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or "unknown"
+        # Streamed bodies are still rendering here, so their total only covers the view
+        http_request_seconds.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        graph_requests_per_http_request.observe(_timings().get("graph", (0, 0, 0))[1], endpoint=endpoint)
+        header = server_timing_header(elapsed)
+        if header:
+            response.headers["Server-Timing"] = header
+        return response
+
+    def render_started(sender, template, context, **extra):
+        g.render_started = time.perf_counter()
+
+    def render_finished(sender, template, context, **extra):
+        started = g.pop("render_started", None)
+        if started is not None:
+            record_phase("render", time.perf_counter() - started)
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+    return app
@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import time
+import base64
+import hashlib
+import threading
+from io import BytesIO
+
+from dotenv import load_dotenv
+from graph_client import graph
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, thumbnails are skipped without it
+    Image = None
+
+load_dotenv(override=True)
+
+PHOTO_CACHE_DIR = os.getenv("PHOTO_CACHE_DIR", os.path.join(".cache", "photos"))
+PHOTO_CACHE_MAX_BYTES = int(os.getenv("PHOTO_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+PHOTO_REVALIDATE_SECONDS = int(os.getenv("PHOTO_REVALIDATE_SECONDS", "3600"))
+PHOTO_THUMBNAIL_SIZE = int(os.getenv("PHOTO_THUMBNAIL_SIZE", "96"))
+
+# Graph user ids are GUIDs, UPNs are allowed too; anything else could escape the cache dir
+_VALID_USER_ID = re.compile(r"^[\w.@-]+$")
+
+
+# ---------------------------------------------------------
+# PHOTO CACHE
+# ---------------------------------------------------------
+class PhotoCache:
+    """
+    On-disk cache of user photos keyed by user id.
+
+    Entries are revalidated against the photo's Graph media ETag once they are
+    older than `revalidate_after` seconds, and the least recently used photos
+    are evicted once the cache grows past `max_bytes`. When Pillow is installed
+    a downscaled thumbnail is stored next to each photo.
+
+    Users without a photo are remembered too so they are not asked for again
+    until the next revalidation.
+    """
+
+    def __init__(self, directory=PHOTO_CACHE_DIR, max_bytes=PHOTO_CACHE_MAX_BYTES,
+                 revalidate_after=PHOTO_REVALIDATE_SECONDS, thumbnail_size=PHOTO_THUMBNAIL_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.thumbnail_size = thumbnail_size if Image is not None else 0
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(directory, "index.json")
+        self._index = self._load_index()
+
+    # ---------------- public API ----------------
+    def get(self, user_id, headers):
+        """Return the cache entry for a user (None if they have no photo), fetching it if needed."""
+        if not _VALID_USER_ID.match(user_id):
+            return None
+        entry = self._entry(user_id)
+        if entry is None or self._is_stale(entry):
+            self.refresh([user_id], headers)
+            entry = self._entry(user_id)
+        return self._use(user_id, entry)
+
+    def refresh(self, user_ids, headers):
+        """
+        Revalidate several users' photos with at most two $batch round trips:
+        one for the media ETags, one to download the photos that changed.
+        """
+        user_ids = [uid for uid in user_ids if _VALID_USER_ID.match(uid)]
+        if not user_ids:
+            return
+        meta = graph.batch([{"url": f"/users/{uid}/photo"} for uid in user_ids], headers=headers)
+
+        changed = []
+        for uid, resp in zip(user_ids, meta):
+            entry = self._entry(uid)
+            if resp["status"] != 200:
+                if resp["status"] == 404:
+                    self._store_missing(uid)
+                elif entry:
+                    # Transient failure, keep serving what we have
+                    self._touch_checked(uid)
+                continue
+            etag = resp["body"].get("@odata.mediaEtag") or ""
+            if entry and entry.get("etag") == etag and os.path.exists(self.path(uid)):
+                self._touch_checked(uid)
+            else:
+                changed.append((uid, etag))
+
+        if not changed:
+            return
+        photos = graph.batch([{"url": f"/users/{uid}/photo/$value"} for uid, _ in changed], headers=headers)
+        for (uid, etag), resp in zip(changed, photos):
+            if resp["status"] == 200 and resp["body"]:
+                content_type = resp["headers"].get("Content-Type", "image/jpeg")
+                self._store(uid, base64.b64decode(resp["body"]), content_type, etag)
+            elif resp["status"] == 404:
+                self._store_missing(uid)
+
+    def is_fresh(self, user_id):
+        entry = self._entry(user_id)
+        return entry is not None and not self._is_stale(entry)
+
+    def version(self, user_id):
+        """Short token that changes whenever the user's photo changes, for cache-busting URLs."""
+        entry = self._entry(user_id)
+        if not entry or not entry.get("etag"):
+            return None
+        return hashlib.sha1(entry["etag"].encode("utf-8")).hexdigest()[:12]
+
+    def path(self, user_id, thumbnail=False):
+        suffix = "_thumb.jpg" if thumbnail else ".img"
+        return os.path.join(self.directory, f"{user_id}{suffix}")
+
+    # ---------------- internals ----------------
+    def _entry(self, user_id):
+        with self._lock:
+            entry = self._index.get(user_id)
+            return dict(entry) if entry else None
+
+    def _is_stale(self, entry):
+        return time.time() - entry.get("checked_at", 0) > self.revalidate_after
+
+    def _use(self, user_id, entry):
+        if not entry or not entry.get("etag"):
+            return None
+        with self._lock:
+            if user_id in self._index:
+                self._index[user_id]["last_used"] = time.time()
+        return entry
+
+    def _touch_checked(self, user_id):
+        with self._lock:
+            if user_id in self._index:
+                self._index[user_id]["checked_at"] = time.time()
+                self._save_index()
+
+    def _store_missing(self, user_id):
+        with self._lock:
+            self._remove_files(user_id)
+            now = time.time()
+            self._index[user_id] = {"etag": None, "size": 0, "checked_at": now, "last_used": now}
+            self._save_index()
+
+    def _store(self, user_id, content, content_type, etag):
+        os.makedirs(self.directory, exist_ok=True)
+        size = len(content)
+        with open(self.path(user_id), "wb") as f:
+            f.write(content)
+
+        has_thumbnail = False
+        if self.thumbnail_size:
+            try:
+                img = Image.open(BytesIO(content))
+                img.thumbnail((self.thumbnail_size, self.thumbnail_size))
+                img.convert("RGB").save(self.path(user_id, thumbnail=True), "JPEG", quality=85)
+                size += os.path.getsize(self.path(user_id, thumbnail=True))
+                has_thumbnail = True
+            except Exception as e:
+                print(f"⚠️ Could not build thumbnail for {user_id}: {e}")
+
+        now = time.time()
+        with self._lock:
+            self._index[user_id] = {
+                "etag": etag,
+                "content_type": content_type,
+                "size": size,
+                "thumbnail": has_thumbnail,
+                "checked_at": now,
+                "last_used": now,
+            }
+            self._evict()
+            self._save_index()
+
+    # Must be called with self._lock held
+    def _evict(self):
+        total = sum(e.get("size", 0) for e in self._index.values())
+        for user_id, entry in sorted(self._index.items(), key=lambda kv: kv[1].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            if not entry.get("size"):
+                continue
+            total -= entry["size"]
+            self._remove_files(user_id)
+            del self._index[user_id]
+
+    def _remove_files(self, user_id):
+        for path in (self.path(user_id), self.path(user_id, thumbnail=True)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+
+photo_cache = PhotoCache()
@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from io import BytesIO
+
+import pandas as pd
+
+from auth import get_graph_headers
+from graph_client import graph, GraphError
+from workbook_writer import WorkbookWriter
+from analytics import EXCLUDED_USERS
+from metrics import timed, background_job
+
+EXCEL_FILE_NAME = "UserAnalytics.xlsx"
+EXCEL_TABLE_NAME = "UserAnalyticsTable"
+EXCEL_SHEET_NAME = "UserAnalytics"
+# App-only tokens have no /me, point this at /users/{upn}/drive or /drives/{id} for them
+EXCEL_DRIVE = os.getenv("EXCEL_DRIVE", "/me/drive")
+
+# Uploads are coalesced so OneDrive sees at most one publish per interval
+PUBLISH_INTERVAL = float(os.getenv("PUBLISH_INTERVAL", "30"))
+
+COLUMNS_ORDER = ["Priority", "User", "total_tasks", "tasks_completed", "tasks_pending",
+                 "tasks_missed", "orders_received", "last_assigned_date"]
+
+# What was last written to each drive, used to skip or shrink the next upload there
+_published = {}
+_publish_lock = threading.Lock()
+# Authorization header hash -> drive id, EXCEL_DRIVE can be a different drive per principal
+_drive_ids = {}
+DRIVE_ID_CACHE_MAX_ENTRIES = 64
+
+
+# ---------------------------------------------------------
+# EXCEL FUNCTIONS
+# ---------------------------------------------------------
+def ensure_excel_file(headers=None):
+    headers = headers or get_graph_headers()
+    r = graph.get(f"{EXCEL_DRIVE}/root:/{EXCEL_FILE_NAME}", headers=headers)
+    if r.status_code == 404:
+        print("📁 Creating new UserAnalytics.xlsx in OneDrive root...")
+        excel_data = BytesIO()
+        pd.DataFrame().to_excel(excel_data, index=False)
+        excel_data.seek(0)
+        resp = graph.put(f"{EXCEL_DRIVE}/root:/{EXCEL_FILE_NAME}:/content", headers=headers, data=excel_data.read())
+        if resp.status_code in [200, 201]:
+            print("✅ Created Excel file successfully.")
+        else:
+            print("❌ Failed to create Excel file:", resp.text)
+    else:
+        print("✅ Excel file exists in OneDrive root.")
+
+
+def build_analytics_table(per_user, priorities=None):
+    """
+    Turn per-user analytics into the (columns, rows) written to the workbook.
+    Cells are plain Python values and missing values are "" so rows compare
+    and hash the same way every time.
+    """
+    filtered_per_user = {user: data for user, data in per_user.items() if user not in EXCLUDED_USERS}
+    if not filtered_per_user:
+        return [], []
+
+    data_columns = []
+    for data in filtered_per_user.values():
+        for col in data:
+            if col not in data_columns:
+                data_columns.append(col)
+    available = set(data_columns) | {"User"} | ({"Priority"} if priorities else set())
+    columns = [col for col in COLUMNS_ORDER if col in available]
+
+    rows = []
+    for user, data in filtered_per_user.items():
+        values = dict(data, User=user)
+        if priorities:
+            values["Priority"] = priorities.get(user)
+        rows.append([_cell(values.get(col)) for col in columns])
+    return columns, rows
+
+
+def _cell(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ""
+    if hasattr(value, "item"):  # numpy scalars
+        return value.item()
+    return value
+
+
+def table_hash(columns, rows):
+    payload = json.dumps([columns, rows], default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def update_user_analytics_excel(per_user, priorities=None, headers=None):
+    """
+    Publish user analytics to UserAnalytics.xlsx in the OneDrive root.
+
+    EXCEL_DRIVE is resolved to a drive id for the given credentials and every
+    drive is tracked separately. Nothing is sent when the table is unchanged
+    since the last publish to that drive. When only some values changed and
+    the users are the same, just those rows are patched through the workbook
+    table API; otherwise the workbook is rebuilt and uploaded. Returns "unchanged", "patched", "uploaded", "empty" or "failed".
+    """
+    columns, rows = build_analytics_table(per_user, priorities)
+    if not rows:
+        print("⚠️ No users to update in Excel.")
+        return "empty"
+
+    digest = table_hash(columns, rows)
+    headers = headers or get_graph_headers()
+    drive_id = _resolve_drive_id(headers)
+    if not drive_id:
+        return "failed"
+    file_path = f"/drives/{drive_id}/root:/{EXCEL_FILE_NAME}"
+
+    with _publish_lock:
+        published = _published.setdefault(drive_id, {"hash": None, "columns": None, "rows": None})
+        if digest == published["hash"]:
+            print("✅ User analytics unchanged, skipping Excel upload.")
+            return "unchanged"
+
+        previous_rows = published["rows"]
+        user_col = columns.index("User")
+        same_shape = (
+            previous_rows is not None
+            and published["columns"] == columns
+            and [r[user_col] for r in previous_rows] == [r[user_col] for r in rows]
+        )
+        if same_shape:
+            changed = [i for i, (old, new) in enumerate(zip(previous_rows, rows)) if old != new]
+            if _patch_table_rows(file_path, changed, rows, headers):
+                published.update(hash=digest, columns=columns, rows=rows)
+                print(f"✅ User analytics Excel patched ({len(changed)} rows).")
+                return "patched"
+            print("⚠️ Row patch failed, uploading the whole workbook instead.")
+
+        if _upload_workbook(file_path, columns, rows, headers):
+            published.update(hash=digest, columns=columns, rows=rows)
+            return "uploaded"
+        return "failed"
+
+
+def _resolve_drive_id(headers):
+    """Id of the drive EXCEL_DRIVE points to for these credentials, looked up once per token."""
+    key = _principal(headers)
+    if key in _drive_ids:
+        return _drive_ids[key]
+    try:
+        resp = graph.get(f"{EXCEL_DRIVE}?$select=id", headers=headers)
+    except GraphError as e:
+        print(f"❌ Could not resolve {EXCEL_DRIVE}: {e}")
+        return None
+    if resp.status_code != 200:
+        print(f"❌ Could not resolve {EXCEL_DRIVE} ({resp.status_code}): {resp.text}")
+        return None
+    drive_id = resp.json().get("id")
+    if drive_id:
+        if len(_drive_ids) >= DRIVE_ID_CACHE_MAX_ENTRIES:
+            _drive_ids.pop(next(iter(_drive_ids)))
+        _drive_ids[key] = drive_id
+    return drive_id
+
+
+def _patch_table_rows(file_path, indexes, rows, headers):
+    # One workbook session, consecutive changed rows go out as a single range PATCH
+    try:
+        with timed("excel_patch"), WorkbookWriter(file_path, headers=headers) as writer:
+            writer.update_rows(EXCEL_TABLE_NAME, {i: rows[i] for i in indexes})
+    except GraphError as e:
+        print(f"❌ Failed to patch Excel rows: {e}")
+        return False
+    return True
+
+
+def _upload_workbook(file_path, columns, rows, headers):
+    # Convert rows to an Excel workbook with table formatting
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+    from openpyxl.worksheet.table import Table, TableStyleInfo
+
+    with timed("excel_build"):
+        wb = Workbook()
+        ws = wb.active
+        ws.title = EXCEL_SHEET_NAME
+        ws.append(columns)
+        for row in rows:
+            ws.append([None if value == "" else value for value in row])
+
+        # Create Excel table
+        tab = Table(displayName=EXCEL_TABLE_NAME, ref=f"A1:{get_column_letter(len(columns))}{len(rows)+1}")
+        style = TableStyleInfo(name="TableStyleMedium9", showFirstColumn=False,
+                               showLastColumn=False, showRowStripes=True, showColumnStripes=False)
+        tab.tableStyleInfo = style
+        ws.add_table(tab)
+
+        excel_data = BytesIO()
+        wb.save(excel_data)
+
+    # Uploading to the path creates the file if it doesn't exist yet
+    with timed("onedrive_upload"):
+        response = graph.put(f"{file_path}:/content", headers=headers, data=excel_data.getvalue())
+    if response.status_code in [200, 201]:
+        print("✅ User analytics Excel updated successfully as a table.")
+        return True
+    print("❌ Failed to update Excel file:", response.text)
+    return False
+
+
+# ---------------------------------------------------------
+# WRITE-BEHIND PUBLISH QUEUE
+# ---------------------------------------------------------
+class PublishQueue:
+    """
+    Takes OneDrive uploads off the request path.
+
+    Requests enqueue the latest analytics and return immediately. A single
+    worker thread publishes at most once per `interval` seconds, and anything
+    enqueued in between is coalesced so only the newest analytics are sent.
+    Publishes made with different credentials can land in different drives,
+    so they are coalesced per principal rather than replacing each other.
+    """
+
+    def __init__(self, publish, interval=PUBLISH_INTERVAL):
+        self.publish = publish
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._pending = {}  # principal -> (per_user, priorities, headers, enqueued at, depth)
+        self._last_attempt = 0.0
+        self._thread = None
+        self._stats = {
+            "published": 0,
+            "coalesced": 0,
+            "last_result": None,
+            "last_success": None,
+            "last_error": None,
+            "last_error_at": None,
+        }
+
+    def enqueue(self, per_user, priorities=None, headers=None):
+        """Queue analytics for publishing, replacing anything not yet sent with the same credentials."""
+        principal = _principal(headers)
+        with self._cond:
+            previous = self._pending.get(principal)
+            if previous is not None:
+                self._stats["coalesced"] += 1
+                enqueued_at, depth = previous[3], previous[4] + 1
+            else:
+                enqueued_at, depth = time.time(), 1
+            self._pending[principal] = (per_user, priorities, headers, enqueued_at, depth)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="excel-publisher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def status(self):
+        """Queue depth, lag and the outcome of the last publishes."""
+        with self._cond:
+            pending = list(self._pending.values())
+            lag = time.time() - min(entry[3] for entry in pending) if pending else 0.0
+            depth = sum(entry[4] for entry in pending)
+            return dict(self._stats, depth=depth, destinations=len(pending), lag_seconds=round(lag, 1),
+                        interval=self.interval)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Hold off until the interval since the last publish has passed
+                wait = self._last_attempt + self.interval - time.monotonic()
+                while wait > 0:
+                    self._cond.wait(wait)
+                    wait = self._last_attempt + self.interval - time.monotonic()
+                batch = list(self._pending.values())
+                self._pending = {}
+                self._last_attempt = time.monotonic()
+
+            for per_user, priorities, headers, _, depth in batch:
+                self._publish_one(per_user, priorities, headers, depth)
+
+    def _publish_one(self, per_user, priorities, headers, depth):
+        try:
+            with background_job("excel_publish"):
+                result = self.publish(per_user, priorities, headers)
+                if result == "failed":
+                    raise RuntimeError("Excel publish failed")
+            error = None
+        except Exception as e:
+            result, error = "failed", str(e)
+
+        with self._cond:
+            self._stats["last_result"] = result
+            if error:
+                self._stats["last_error"] = error
+                self._stats["last_error_at"] = datetime.now().isoformat(timespec="seconds")
+                print(f"❌ Excel publish failed: {error}")
+            else:
+                self._stats["published"] += depth
+                self._stats["last_success"] = datetime.now().isoformat(timespec="seconds")
+
+
+def _principal(headers):
+    """Who a publish is made as, None for the background job's own credentials."""
+    token = (headers or {}).get("Authorization")
+    return hashlib.sha256(token.encode("utf-8")).hexdigest() if token else None
+
+
+publish_queue = PublishQueue(update_user_analytics_excel)
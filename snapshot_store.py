@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+from dotenv import load_dotenv
+
+try:
+    import pyarrow  # noqa: F401  (pandas picks it up for Parquet)
+except ImportError:  # pyarrow is optional, snapshots are pickled without it
+    pyarrow = None
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, only threads are serialized there
+    fcntl = None
+
+load_dotenv(override=True)
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(".cache", "snapshots"))
+SNAPSHOT_STORE = os.getenv("SNAPSHOT_STORE", "on").lower() not in ("off", "0", "false")
+
+# Low-cardinality columns stored as categories, a handful of distinct values per snapshot
+CATEGORICAL_COLUMNS = ["AssignedTo", "Status", "SubmissionStatus"]
+
+
+# ---------------------------------------------------------
+# SNAPSHOT STORE
+# ---------------------------------------------------------
+class SnapshotStore:
+    """
+    Flattened list snapshots persisted on disk so a new process can serve its
+    first page without a full Graph pull.
+
+    Rows are stored column by column, as Parquet when pyarrow is installed and
+    as a pickled DataFrame otherwise, with the low-cardinality columns
+    categorical. A JSON sidecar next to each file keeps the snapshot version,
+    when it was saved and the Graph delta link that produced it.
+    Files are written to unique temp names and replaced atomically, and the
+    frame and its sidecar are written (and read) together under a per-key
+    file lock, so several worker processes can share one store without
+    pairing one worker's rows with another's delta link.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    # ---------------- public API ----------------
+    def save(self, key, rows, version, delta_link=None, **meta):
+        """
+        Persist rows for key. When the stored snapshot already has this version
+        only the sidecar is rewritten, with the new delta link and checked_at
+        time, so readers know it is still current.
+        """
+        base = self._base(key)
+        os.makedirs(self.directory, exist_ok=True)
+        with self._locked(base, exclusive=True):
+            current = self.meta(key)
+            # Every delta sync hands out a new delta link, the rows only change with the version
+            if current and current.get("version") == version:
+                self._write_json(base + ".json", dict(current, **meta, delta_link=delta_link, checked_at=time.time()))
+                return False
+
+            # object dtype keeps ints as ints next to missing values instead of turning them into floats
+            df = pd.DataFrame(rows, dtype=object)
+            for col in CATEGORICAL_COLUMNS:
+                if col in df.columns:
+                    df[col] = df[col].astype("category")
+            fmt = self._write_frame(df, base)
+            sidecar = dict(meta, key=list(key), version=version, delta_link=delta_link,
+                           format=fmt, rows=len(df), saved_at=time.time(), checked_at=time.time())
+            self._write_json(base + ".json", sidecar)
+        return True
+
+    def load(self, key):
+        """Return (rows, meta) for key, or (None, None) when nothing usable is stored."""
+        base = self._base(key)
+        if not os.path.exists(base + ".json"):
+            return None, None
+        with self._locked(base, exclusive=False):
+            meta = self.meta(key)
+            if not meta:
+                return None, None
+            path = base + (".parquet" if meta.get("format") == "parquet" else ".pkl")
+            try:
+                if meta.get("format") == "parquet":
+                    df = pd.read_parquet(path, dtype_backend="numpy_nullable")
+                else:
+                    df = pd.read_pickle(path)
+            except Exception as e:
+                print(f"⚠️ Could not read snapshot {path}: {e}")
+                return None, None
+        return _records(df), meta
+
+    def age(self, key):
+        """Seconds since the stored snapshot for key was last confirmed current, None if there is none."""
+        meta = self.meta(key)
+        if not meta:
+            return None
+        return time.time() - meta.get("checked_at", meta.get("saved_at", 0))
+
+    def meta(self, key):
+        try:
+            with open(self._base(key) + ".json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def clear(self, key):
+        base = self._base(key)
+        if not os.path.isdir(self.directory):
+            return
+        with self._locked(base, exclusive=True):
+            for suffix in (".json", ".parquet", ".pkl"):
+                if os.path.exists(base + suffix):
+                    os.remove(base + suffix)
+
+    # ---------------- internals ----------------
+    def _base(self, key):
+        name = hashlib.sha1("|".join(map(str, key)).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self, base, exclusive):
+        """Hold the key's lock: threads of this process, then other processes through flock."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(base + ".lock", "a+") as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _write_frame(self, df, base):
+        if pyarrow is not None:
+            try:
+                self._replace(base + ".parquet", lambda tmp: df.to_parquet(tmp, index=False))
+                return "parquet"
+            except Exception as e:
+                # Mixed-type columns can't be written as Parquet, keep the snapshot anyway
+                print(f"⚠️ Parquet snapshot failed, pickling instead: {e}")
+        self._replace(base + ".pkl", df.to_pickle)
+        return "pickle"
+
+    def _write_json(self, path, data):
+        def write(tmp):
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        self._replace(path, write)
+
+    def _replace(self, path, write):
+        """Write through a temp file no other writer uses, then swap it in."""
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+def _records(df):
+    """DataFrame rows as plain dicts with None for missing values, converted column by column."""
+    names = list(df.columns)
+    columns = [df[name].to_numpy(dtype=object, na_value=None).tolist() for name in names]
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+snapshot_store = SnapshotStore()
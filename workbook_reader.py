@@ -0,0 +1,214 @@
+import os
+import time
+import hashlib
+import zipfile
+import threading
+import posixpath
+from io import BytesIO
+from collections import defaultdict
+from xml.etree import ElementTree
+
+from auth import get_graph_headers
+from graph_client import graph, GraphError
+from metrics import timed
+
+# Within this many seconds a workbook is served without asking Graph whether it changed
+WORKBOOK_REVALIDATE_SECONDS = int(os.getenv("WORKBOOK_REVALIDATE_SECONDS", "30"))
+WORKBOOK_CACHE_MAX_ENTRIES = int(os.getenv("WORKBOOK_CACHE_MAX_ENTRIES", "8"))
+
+_NS = {
+    "main": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+_R_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+
+
+# ---------------------------------------------------------
+# WORKBOOK READER
+# ---------------------------------------------------------
+class WorkbookReader:
+    """
+    Reads every table of an Excel workbook from one download.
+
+    The drive item is resolved once and its content downloaded once; tables
+    are then parsed locally (table definitions from the package XML, cells
+    with openpyxl in read-only mode). Parsed workbooks are cached by drive id
+    and item id, so a /me/drive path resolves to each user's own file. After
+    `revalidate_after` seconds a single metadata call decides, by eTag,
+    whether the cached copy is still good or the file is downloaded again.
+    """
+
+    def __init__(self, revalidate_after=WORKBOOK_REVALIDATE_SECONDS, max_entries=WORKBOOK_CACHE_MAX_ENTRIES):
+        self.revalidate_after = revalidate_after
+        self.max_entries = max_entries
+        self._entries = {}
+        # (file path, principal) -> (drive id, item id) it last resolved to
+        self._aliases = {}
+        self._locks = defaultdict(threading.Lock)
+
+    # ---------------- public API ----------------
+    def tables(self, file_path, headers=None):
+        """{table name: {"columns": [...], "rows": [[...], ...]}} for a workbook, {} if it can't be read."""
+        entry = self._load(file_path, headers)
+        return entry["tables"] if entry else {}
+
+    def table(self, file_path, table_name, headers=None):
+        tables = self.tables(file_path, headers)
+        if table_name in tables:
+            return tables[table_name]
+        # Graph also accepts table names case-insensitively
+        lowered = {name.lower(): table for name, table in tables.items()}
+        return lowered.get(str(table_name).lower())
+
+    def item_id(self, file_path, headers=None):
+        entry = self._load(file_path, headers)
+        return entry["item_id"] if entry else None
+
+    def invalidate(self, file_path=None):
+        """Forget a cached workbook (or all of them), e.g. after writing to it."""
+        if file_path is None:
+            self._entries.clear()
+            self._aliases.clear()
+            return
+        for alias in [alias for alias in self._aliases if alias[0] == file_path]:
+            self._entries.pop(self._aliases.pop(alias), None)
+
+    # ---------------- internals ----------------
+    def _load(self, file_path, headers):
+        headers = headers or get_graph_headers()
+        # The same /me/drive path is a different file for every user
+        alias = (file_path, _principal(headers))
+        with self._locks[alias]:
+            entry = self._entries.get(self._aliases.get(alias))
+            if entry and time.monotonic() - entry["checked_at"] < self.revalidate_after:
+                return entry
+
+            resp = graph.get(file_path, headers=headers)
+            if resp.status_code != 200:
+                print(f"Graph API error ({resp.status_code}) resolving workbook {file_path}: {resp.text}")
+                return None
+            item = resp.json()
+            key = (item.get("parentReference", {}).get("driveId"), item.get("id"))
+            if alias not in self._aliases and len(self._aliases) >= self.max_entries * 16:
+                self._aliases.pop(next(iter(self._aliases)))
+            self._aliases[alias] = key
+
+            etag = item.get("eTag")
+            entry = self._entries.get(key)
+            if entry and entry["etag"] == etag:
+                entry["checked_at"] = time.monotonic()
+                return entry
+
+            content = self._download(item, headers)
+            if content is None:
+                return entry
+            with timed("workbook_parse"):
+                tables = parse_workbook_tables(content)
+            entry = {"item_id": item.get("id"), "etag": etag, "checked_at": time.monotonic(), "tables": tables}
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = entry
+            return entry
+
+    def _download(self, item, headers):
+        # The pre-authenticated download URL skips one redirect through Graph
+        url = item.get("@microsoft.graph.downloadUrl")
+        drive_id = item.get("parentReference", {}).get("driveId")
+        try:
+            if url:
+                resp = graph.get(url)
+            elif drive_id:
+                resp = graph.get(f"/drives/{drive_id}/items/{item.get('id')}/content", headers=headers)
+            else:
+                resp = graph.get(f"/me/drive/items/{item.get('id')}/content", headers=headers)
+        except GraphError as e:
+            print(f"❌ Workbook download failed: {e}")
+            return None
+        if resp.status_code != 200:
+            print(f"❌ Workbook download failed ({resp.status_code}): {resp.text[:200]}")
+            return None
+        return resp.content
+
+
+def _principal(headers):
+    """Who a request is made as, without keeping the token itself around."""
+    token = (headers or {}).get("Authorization", "")
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+
+# ---------------------------------------------------------
+# LOCAL PARSING
+# ---------------------------------------------------------
+def parse_workbook_tables(content):
+    """Parse every table of an .xlsx file into {name: {"columns": [...], "rows": [[...], ...]}}."""
+    from openpyxl import load_workbook
+    from openpyxl.utils.cell import range_boundaries
+
+    definitions = _table_definitions(content)
+    wb = load_workbook(BytesIO(content), read_only=True, data_only=True)
+    try:
+        tables = {}
+        for sheet_name, name, ref, header_rows, totals_rows in definitions:
+            min_col, min_row, max_col, max_row = range_boundaries(ref)
+            cells = wb[sheet_name].iter_rows(min_row=min_row, max_row=max_row, min_col=min_col,
+                                             max_col=max_col, values_only=True)
+            # Graph returns empty cells as "", keep rows looking the same
+            values = [["" if v is None else v for v in row] for row in cells]
+            width = max_col - min_col + 1
+            values = [row + [""] * (width - len(row)) for row in values]
+            columns = [str(v) for v in values[0]] if header_rows else [f"Column{i + 1}" for i in range(width)]
+            rows = values[header_rows:len(values) - totals_rows]
+            tables[name] = {"columns": columns, "rows": rows}
+        return tables
+    finally:
+        wb.close()
+
+
+def _table_definitions(content):
+    """(sheet name, table name, range, header rows, totals rows) for each table, read from the package XML."""
+    definitions = []
+    with zipfile.ZipFile(BytesIO(content)) as package:
+        names = set(package.namelist())
+        workbook = ElementTree.fromstring(package.read("xl/workbook.xml"))
+        workbook_rels = _relationships(package, "xl/workbook.xml")
+        for sheet in workbook.iterfind("main:sheets/main:sheet", _NS):
+            sheet_path = workbook_rels.get(sheet.get(_R_ID))
+            if not sheet_path or sheet_path not in names:
+                continue
+            sheet_xml = ElementTree.fromstring(package.read(sheet_path))
+            sheet_rels = _relationships(package, sheet_path)
+            for part in sheet_xml.iterfind("main:tableParts/main:tablePart", _NS):
+                table_path = sheet_rels.get(part.get(_R_ID))
+                if not table_path or table_path not in names:
+                    continue
+                table = ElementTree.fromstring(package.read(table_path))
+                definitions.append((
+                    sheet.get("name"),
+                    table.get("displayName") or table.get("name"),
+                    table.get("ref"),
+                    int(table.get("headerRowCount", "1")),
+                    int(table.get("totalsRowCount", "0")),
+                ))
+    return definitions
+
+
+def _relationships(package, part_path):
+    """Relationship id -> absolute part path for one package part."""
+    folder, name = posixpath.split(part_path)
+    rels_path = posixpath.join(folder, "_rels", name + ".rels")
+    try:
+        rels = ElementTree.fromstring(package.read(rels_path))
+    except KeyError:
+        return {}
+    targets = {}
+    for rel in rels.iterfind("rel:Relationship", _NS):
+        target = rel.get("Target", "")
+        if target.startswith("/"):
+            path = target.lstrip("/")
+        else:
+            path = posixpath.normpath(posixpath.join(folder, target))
+        targets[rel.get("Id")] = path
+    return targets
+
+
+workbook_reader = WorkbookReader()
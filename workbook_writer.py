@@ -0,0 +1,149 @@
+import os
+import re
+from urllib.parse import quote
+
+from auth import get_graph_headers
+from graph_client import graph, GraphError
+from metrics import timed
+
+# Rows sent per rows/add call or range PATCH
+WORKBOOK_WRITE_CHUNK = int(os.getenv("WORKBOOK_WRITE_CHUNK", "200"))
+
+_ADDRESS = re.compile(r"^(?:'?(?P<sheet>.+?)'?!)?\$?(?P<c1>[A-Z]+)\$?(?P<r1>\d+)(?::\$?(?P<c2>[A-Z]+)\$?(?P<r2>\d+))?$")
+
+
+def workbook_url(file_path):
+    """Workbook API base for a drive item path (/me/drive/root:/x.xlsx) or item URL (/drives/{id}/items/{id})."""
+    return f"{file_path}:/workbook" if ":/" in file_path else f"{file_path}/workbook"
+
+
+# ---------------------------------------------------------
+# BULK WORKBOOK WRITER
+# ---------------------------------------------------------
+class WorkbookWriter:
+    """
+    Writes many table rows over one persistent workbook session.
+
+        with WorkbookWriter("/me/drive/root:/Tasks.xlsx") as writer:
+            writer.add_rows("Tasks", new_rows)
+            writer.update_rows("Tasks", {3: row, 4: row, 9: row})
+
+    New rows go out WORKBOOK_WRITE_CHUNK at a time through rows/add. Updated
+    rows are grouped into runs of consecutive indexes and each run is written
+    with a single range PATCH. The session is closed once on exit. If Excel
+    refuses a session the writes are still sent, just without one.
+    Failed writes raise GraphError.
+    """
+
+    def __init__(self, file_path, headers=None, persist=True, chunk_size=WORKBOOK_WRITE_CHUNK):
+        self.base = workbook_url(file_path)
+        self.headers = dict(headers or get_graph_headers() or {})
+        self.persist = persist
+        self.chunk_size = max(1, chunk_size)
+        self.session_id = None
+        self._body_ranges = {}
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def open(self):
+        resp = graph.post(f"{self.base}/createSession", headers=self.headers, json={"persistChanges": self.persist})
+        if resp.status_code in (200, 201):
+            self.session_id = resp.json().get("id")
+            self.headers["workbook-session-id"] = self.session_id
+        else:
+            print(f"⚠️ Could not open a workbook session ({resp.status_code}), writing without one.")
+
+    def close(self):
+        if not self.session_id:
+            return
+        resp = graph.post(f"{self.base}/closeSession", headers=self.headers)
+        if resp.status_code not in (200, 201, 204):
+            print(f"⚠️ Could not close workbook session ({resp.status_code}): {resp.text}")
+        self.headers.pop("workbook-session-id", None)
+        self.session_id = None
+
+    def add_rows(self, table_name, rows):
+        """Append rows to a table, returns how many were added."""
+        rows = [list(row) for row in rows]
+        url = f"{self._table_url(table_name)}/rows/add"
+        with timed("excel_write"):
+            for start in range(0, len(rows), self.chunk_size):
+                chunk = rows[start:start + self.chunk_size]
+                resp = graph.post(url, headers=self.headers, json={"index": None, "values": chunk})
+                if resp.status_code not in (200, 201):
+                    raise GraphError(f"Adding {len(chunk)} rows to {table_name} failed ({resp.status_code}): {resp.text}",
+                                     resp.status_code, graph.url(url))
+        self._body_ranges.pop(table_name, None)
+        return len(rows)
+
+    def update_rows(self, table_name, rows_by_index):
+        """Overwrite table rows given as {0-based row index: values}, returns how many were written."""
+        written = 0
+        with timed("excel_write"):
+            for start, run in self._runs(rows_by_index):
+                if len(run) == 1:
+                    url = f"{self._table_url(table_name)}/rows/itemAt(index={start})"
+                else:
+                    url = self._rows_range_url(table_name, start, len(run), len(run[0]))
+                resp = graph.patch(url, headers=self.headers, json={"values": run})
+                if resp.status_code != 200:
+                    raise GraphError(f"Updating rows {start}-{start + len(run) - 1} of {table_name} failed "
+                                     f"({resp.status_code}): {resp.text}", resp.status_code, graph.url(url))
+                written += len(run)
+        return written
+
+    # ---------------- internals ----------------
+    def _table_url(self, table_name):
+        return f"{self.base}/tables/{quote(str(table_name), safe='')}"
+
+    def _runs(self, rows_by_index):
+        """Consecutive row indexes grouped into (first index, [rows]) runs of at most chunk_size."""
+        runs = []
+        for index in sorted(rows_by_index):
+            values = list(rows_by_index[index])
+            if runs and runs[-1][0] + len(runs[-1][1]) == index and len(runs[-1][1]) < self.chunk_size:
+                runs[-1][1].append(values)
+            else:
+                runs.append((index, [values]))
+        return runs
+
+    def _rows_range_url(self, table_name, start, count, width):
+        sheet, first_col, first_row = self._body_range(table_name)
+        last_col = _column_letter(_column_number(first_col) + width - 1)
+        address = f"{first_col}{first_row + start}:{last_col}{first_row + start + count - 1}"
+        return f"{self.base}/worksheets/{quote(sheet, safe='')}/range(address='{address}')"
+
+    def _body_range(self, table_name):
+        """Sheet, first column and first data row of a table, looked up once per table."""
+        if table_name not in self._body_ranges:
+            url = f"{self._table_url(table_name)}/dataBodyRange?$select=address"
+            resp = graph.get(url, headers=self.headers)
+            if resp.status_code != 200:
+                raise GraphError(f"Reading the range of {table_name} failed ({resp.status_code}): {resp.text}",
+                                 resp.status_code, graph.url(url))
+            match = _ADDRESS.match(resp.json().get("address", ""))
+            if not match or not match.group("sheet"):
+                raise GraphError(f"Unexpected range address for {table_name}: {resp.json().get('address')}")
+            self._body_ranges[table_name] = (match.group("sheet"), match.group("c1"), int(match.group("r1")))
+        return self._body_ranges[table_name]
+
+
+def _column_number(letters):
+    number = 0
+    for ch in letters:
+        number = number * 26 + ord(ch) - ord("A") + 1
+    return number
+
+
+def _column_letter(number):
+    letters = ""
+    while number:
+        number, rem = divmod(number - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters